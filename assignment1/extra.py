@@ -1,6 +1,5 @@
 import ast
 import os
-import random
 import statistics
 
 import numpy
@@ -11,19 +10,20 @@ import main as main_file
 
 def main():
     """Attempts to plot the relationship between strength of heuristic and compression ratio."""
-    random.seed(42)  # I used 42 for the experiments
+    seed = 42  # I used 42 for the experiments
     problem, states = main_file.a1_problems()
     puzzle_no = 8  # For the 8-puzzle, this is set to 8
     strengths = [8, 7, 6, 5, 4, 3, 2, 1]
 
-    # Can't save pdbs to file; too big!
-    # Next best thing: saving the results
+    # Saving the results as well as the PDBs skips the experiments next time
     if os.path.isfile("results.txt"):
         with open("results.txt") as file:
             contents = file.read()
         results = ast.literal_eval(contents)
     else:
-        results = main_file.run_experiments(states, problem, 8, strengths, [1])
+        pdbs = main_file.get_pdbs("PDBs", puzzle_no, strengths, problem)
+        results = main_file.run_experiments(states, problem, 8, strengths, [1],
+                                            pdbs, seed=seed)
         with open("results.txt", "w") as file:
             file.write(str(results))
 
@@ -1,19 +1,29 @@
-import ast
+import concurrent.futures
 import itertools
 import os
-import random
-import statistics
+import re
+import shutil
 import string
 import sys
-from typing import Any, Union
+import tempfile
+from typing import Any, Optional, Union
 
+import numpy
 import openpyxl
 
 sys.path.append(os.path.relpath("../"))
+import heuristics
+import pattern_databases
 import problems
+import results
 import search
 
 Number = Union[int, float]
+# PDBs by strength, then by the tile IDs merged to make them
+PDBCollection = dict[int, dict[tuple[int], pattern_databases.PatternDatabase]]
+# For each pattern, the pattern whose PDB answers for it, and the symmetry
+# taking its states to that pattern's (None if it is that pattern)
+Mirrors = dict[tuple[int], tuple[tuple[int], Optional[tuple]]]
 
 sizes = [0.25, 0.5, 0.75, 1]
 
@@ -37,11 +47,57 @@ def excel_cell_A1(size: int, strength: int, problem: int,
 
 
 def abstractify(state: str, ids: tuple[int]) -> str:
-    """Given a tuple, creates an abstracted version of a TileProblem state."""
+    """Given a tuple, creates an abstracted version of a TileProblem state.
+    Only whole tile IDs in 'at' predicates are replaced, so tile 1 is never
+    confused with tile 10 (or with a location)."""
     ids = [str(num) for num in ids]
-    for num in ids:
-        state = state.replace(num, ids[0])
-    return state
+    merged = set(ids)
+
+    def merge(match: re.Match) -> str:
+        if match.group(1) in merged:
+            return f"at({ids[0]},"
+        return match.group(0)
+
+    return re.sub(r"at\(\s*([^,()]+?)\s*,", merge, state)
+
+
+def pattern_table(problem: problems.TileProblem, pattern: tuple[int]) -> bytes:
+    """Returns the table abstracting encoded states by merging the given tile
+    IDs (see TileProblem.abstraction)."""
+    return problem.abstraction({tile: pattern[0] for tile in pattern})
+
+
+def pattern_mirrors(problem: problems.TileProblem,
+                    patterns: list[tuple[int]]) -> Mirrors:
+    """Groups patterns that are mirror images of each other under the
+    problem's symmetries (see TileProblem.automorphisms), so that only one
+    PDB needs to be made for each group. For the Assignment 1 goal, this
+    roughly halves the number of PDBs."""
+    symmetries = problem.automorphisms()[1:]  # Leaving out the identity
+    wanted = set(patterns)
+    mirrors = {}
+    for pattern in patterns:
+        if pattern in mirrors:
+            continue
+        mirrors[pattern] = (pattern, None)
+        for symmetry in symmetries:
+            image = problem.symmetric_tiles(pattern, symmetry)
+            image = tuple(sorted(int(tile) for tile in image))
+            if image in wanted and image not in mirrors:
+                mirrors[image] = (pattern, problem.invert(symmetry))
+    return mirrors
+
+
+def mirror_pdbs(problem: problems.TileProblem, pdbs: PDBCollection,
+                mirrors: Mirrors) -> PDBCollection:
+    """Fills in the PDBs of mirrored patterns with views of the PDBs that
+    answer for them, and returns the collection."""
+    for pattern, (source, symmetry) in mirrors.items():
+        if symmetry is not None:
+            pdbs[len(pattern)][pattern] = heuristics.SymmetricPatternDatabase(
+                problem, pdbs[len(source)][source],
+                pattern_table(problem, source), symmetry)
+    return pdbs
 
 
 def choose_n(total, sample_size):
@@ -51,53 +107,155 @@ def choose_n(total, sample_size):
 
 
 def a1_problems(goal_file="GoalState.txt", problem_file="Problems.txt"):
-    """Returns the default problems for Assignment 1."""
-    with open("GoalState.txt") as file:
+    """Returns the default problems for Assignment 1, with the states already
+    encoded."""
+    with open(goal_file) as file:
         goal = file.read().strip()
     problem = problems.TileProblem(goal)
-
-    with open("Problems.txt") as file:
-        contents = file.readlines()
-    states = [state.strip() for state in contents]
-
+    states = problem.load_states(problem_file)
     return problem, states
 
 
-def make_pdbs(
-        puzzle_no: int, strengths: list[int],
-        problem: problems.Problem) -> dict[int:dict[tuple[int]:dict[str:int]]]:
-    """Constructs abstracted PDBs for a problem space."""
-    pdbs = {}
-    goal = str(problem)
-    for strength in strengths:
-        pdbs[strength] = {}
-        for pattern in choose_n(puzzle_no, strength):
-            print(f"Constructing PDB by merging these tile IDs: {pattern}")
-            new_goal = abstractify(goal, pattern)
-            pdbs[strength][pattern] = search.make_pdb(new_goal, problem)
-    return pdbs
-
-
-def get_pdbs(
-        filename: str, puzzle_no: int, strengths: list[int],
-        problem: problems.Problem) -> dict[int:dict[tuple[int]:dict[str:int]]]:
-    """Attempts to retrieve PDB file. If not found, makes from scratch."""
-    goal = str(problem)
-    if os.path.isfile(filename):
-        with open(filename) as file:
-            print("Reading existing PDB file...")
-            pdbs_string = file.read()
-        print("Loading PDBs (this may take a few minutes)...")
-        pdbs = ast.literal_eval(pdbs_string)
-        print("PDBs loaded.")
-
-    else:
-        print("Generating PDBs from scratch - this will take a wee while.")
-        pdbs = make_pdbs(puzzle_no, strengths, problem)
-        print("All PDBs constructed.")
-        print("Writing PDBs to file for later...")
-        with open(filename, "w") as file:
-            file.write(str(pdbs))
+def make_abstract_pdb(
+        problem: problems.TileProblem,
+        pattern: tuple[int]) -> pattern_databases.PatternDatabase:
+    """Constructs the PDB for a problem space with the given tile IDs merged."""
+    print(f"Constructing PDB by merging these tile IDs: {pattern}")
+    abstract_goal = problem.abstract(problem.goal,
+                                     pattern_table(problem, pattern))
+    pdb = search.make_pdb(abstract_goal, problem)
+    pdb.pattern = pattern
+    return pdb
+
+
+worker_problem = None  # The problem space used by PDB worker processes
+
+
+def start_pdb_worker(problem: problems.TileProblem):
+    """Gives a PDB worker process the problem space to construct PDBs for."""
+    global worker_problem
+    worker_problem = problem
+
+
+def save_abstract_pdb(pattern: tuple[int], directory: str) -> str:
+    """Constructs a PDB in a worker process and saves it to a PDB file.
+    Returns the file's name."""
+    filename = pdb_filename(directory, pattern)
+    make_abstract_pdb(worker_problem, pattern).save(filename)
+    return filename
+
+
+def build_pdb_files(problem: problems.TileProblem, patterns: list[tuple[int]],
+                    directory: str, workers: int = 1) -> list[str]:
+    """Constructs the PDBs for the given patterns and saves them to PDB files
+    in a directory, spreading patterns over a pool of worker processes.
+    Returns the files' names, in the same order as the patterns."""
+    directories = itertools.repeat(directory)
+    if workers == 1:
+        start_pdb_worker(problem)
+        return list(map(save_abstract_pdb, patterns, directories))
+    with concurrent.futures.ProcessPoolExecutor(
+            workers, initializer=start_pdb_worker,
+            initargs=(problem,)) as executor:
+        return list(executor.map(save_abstract_pdb, patterns, directories))
+
+
+def make_pdbs(puzzle_no: int,
+              strengths: list[int],
+              problem: problems.Problem,
+              workers: int = 1) -> PDBCollection:
+    """Constructs abstracted PDBs for a problem space.
+    Patterns that mirror others under the problem's symmetries get views of
+    their mirror images' PDBs instead of tables of their own.
+    With more than one worker, PDBs are constructed in parallel processes.
+    These save them to PDB files in a temporary directory, which are then
+    memory-mapped, so tables are never sent between processes. The directory
+    is removed once they are mapped (which leaves the mappings valid, except
+    on Windows, where files still mapped are left behind)."""
+    pdbs = {strength: {} for strength in strengths}
+    mirrors = pattern_mirrors(problem, [
+        pattern for strength in strengths
+        for pattern in choose_n(puzzle_no, strength)
+    ])
+    patterns = [
+        pattern for pattern, (source, _) in mirrors.items()
+        if source == pattern
+    ]
+    if workers == 1:
+        for pattern in patterns:
+            pdbs[len(pattern)][pattern] = make_abstract_pdb(problem, pattern)
+        return mirror_pdbs(problem, pdbs, mirrors)
+
+    directory = tempfile.mkdtemp(prefix="pdbs-")
+    try:
+        filenames = build_pdb_files(problem, patterns, directory, workers)
+        for pattern, filename in zip(patterns, filenames):
+            pdb = pattern_databases.PatternDatabase.load(filename)
+            pdbs[len(pattern)][pattern] = pdb
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return mirror_pdbs(problem, pdbs, mirrors)
+
+
+def pdb_filename(directory: str, pattern: tuple[int]) -> str:
+    """Returns the file in which the PDB for a pattern is stored."""
+    return os.path.join(directory, "-".join(map(str, pattern)) + ".pdb")
+
+
+def get_pdbs(directory: str,
+             puzzle_no: int,
+             strengths: list[int],
+             problem: problems.Problem,
+             workers: int = 1) -> PDBCollection:
+    """Retrieves PDBs from a directory of PDB files. Any not found (or made
+    for a different goal) are made from scratch, using the given number of
+    worker processes, and saved there. As in make_pdbs, patterns that mirror
+    others need no files of their own.
+    Files are memory-mapped, so loading existing PDBs is almost instant."""
+    os.makedirs(directory, exist_ok=True)
+    pdbs = {strength: {} for strength in strengths}
+    mirrors = pattern_mirrors(problem, [
+        pattern for strength in strengths
+        for pattern in choose_n(puzzle_no, strength)
+    ])
+    missing = []
+    for pattern, (source, _) in mirrors.items():
+        if source != pattern:
+            continue
+        filename = pdb_filename(directory, pattern)
+        if os.path.isfile(filename):
+            pdb = pattern_databases.PatternDatabase.load(filename)
+            abstract_goal = problem.abstract(problem.goal,
+                                             pattern_table(problem, pattern))
+            if pdb.goal == abstract_goal:
+                pdbs[len(pattern)][pattern] = pdb
+                continue
+        missing.append(pattern)
+
+    filenames = build_pdb_files(problem, missing, directory, workers)
+    for pattern, filename in zip(missing, filenames):
+        pdb = pattern_databases.PatternDatabase.load(filename)
+        pdbs[len(pattern)][pattern] = pdb
+    return mirror_pdbs(problem, pdbs, mirrors)
+
+
+def heuristic_matrix(initial_states: list[Union[str, bytes]],
+                     problem: problems.TileProblem,
+                     patterns: list[tuple[int]],
+                     pdbs: dict[tuple[int],
+                                pattern_databases.PatternDatabase]
+                     ) -> numpy.ndarray:
+    """Given some states and patterns, returns a matrix with a row for each
+    pattern and a column for each state, holding the state's heuristic value
+    under that pattern's PDB."""
+    matrix = numpy.empty((len(patterns), len(initial_states)))
+    states = [problem.encode(state) for state in initial_states]
+    for row, pattern in enumerate(patterns):
+        pdb = pdbs[pattern]
+        table = pattern_table(problem, pattern)
+        for column, state in enumerate(states):
+            matrix[row, column] = pdb[problem.abstract(state, table)]
+    return matrix
 
 
 def run_experiments(initial_states,
@@ -106,48 +264,59 @@ def run_experiments(initial_states,
                     strengths,
                     sizes,
                     pdbs=None,
-                    runs=100):
-    """Runs experiments for Assignment 1."""
+                    runs=100,
+                    seed=None,
+                    sink: Optional[results.ResultSink] = None):
+    """Runs experiments for Assignment 1.
+    Each state's heuristic values are looked up once per pattern. All runs
+    for a strength and sample size are then sampled together, with a random
+    generator seeded by seed (so that results can be reproduced).
+    If a sink is given, each result is also written to it as soon as its
+    strength and sample size are finished."""
     if pdbs == None:
         pdbs = make_pdbs(puzzle_no, strengths, problem)
     patterns = {
         strength: choose_n(puzzle_no, strength)
         for strength in strengths
     }
-    results = []
+    generator = numpy.random.default_rng(seed)
+    experiment_results = []
 
     for strength in strengths:
+        h_values = heuristic_matrix(initial_states, problem,
+                                    patterns[strength], pdbs[strength])
         for size in sizes:
             sample_size = int(len(patterns[strength]) * size)
-            for problem_no, state in enumerate(initial_states):
-                means = []
-                stdevs = []
-                for _ in range(runs):
-                    h_values = []
-                    for pattern in random.sample(patterns[strength],
-                                                 sample_size):
-                        pdb = pdbs[strength][pattern]
-                        abstract_state = abstractify(state, pattern)
-                        abstract_state = problem.canonical(abstract_state)
-                        h_values.append(pdb[abstract_state])
-                    means.append(statistics.mean(h_values))
-                    try: # May only have one PDB if using all tile IDs
-                        stdevs.append(statistics.stdev(h_values))
-                    except statistics.StatisticsError:
-                        stdevs.append(0) # In which case no stdev is appropriate
-                mean = statistics.mean(means)
-                mean_stdev = statistics.mean(stdevs)
-                results.append((size, strength, problem_no, mean, mean_stdev))
-
-    return results
-
-
-def write_to_excel(results, filename, sheetname):
-    """Writes Assignment 1 results to an Excel sheet."""
+            # Each run samples patterns without replacement, by taking the
+            # first few of a random permutation of all patterns
+            permutations = generator.random((runs, len(patterns[strength])))
+            samples = permutations.argsort(axis=1)[:, :sample_size]
+            sampled = h_values[samples]  # Indexed by run, pattern, state
+            means = sampled.mean(axis=1)
+            if sample_size > 1:
+                stdevs = sampled.std(axis=1, ddof=1)
+            else:  # May only have one PDB if using all tile IDs
+                stdevs = numpy.zeros_like(means)  # So no stdev is appropriate
+            mean = means.mean(axis=0)
+            mean_stdev = stdevs.mean(axis=0)
+            for problem_no in range(len(initial_states)):
+                result = (size, strength, problem_no, float(mean[problem_no]),
+                          float(mean_stdev[problem_no]))
+                experiment_results.append(result)
+                if sink is not None:
+                    sink.write(result)
+
+    return experiment_results
+
+
+def write_to_excel(experiment_results, filename, sheetname):
+    """Writes Assignment 1 results to an Excel sheet.
+    The sheet is laid out in advance, so it is filled in cell by cell rather
+    than streamed (see Results.csv for a streamed copy)."""
     workbook = openpyxl.load_workbook(filename)
     sheet = workbook[sheetname]
 
-    for size, strength, problem_no, mean, stdev in results:
+    for size, strength, problem_no, mean, stdev in experiment_results:
         mean_cell = excel_cell_A1(size, strength, problem_no, False)
         stdev_cell = excel_cell_A1(size, strength, problem_no, True)
         sheet[mean_cell] = mean
@@ -173,24 +342,28 @@ def main(use_file=True):
     same directory, in the form they were provided on Canvas.
     Takes a few minutes at best - you might want to put the kettle on.
     """
-    random.seed(42)  # I used 42 for the experiments
+    seed = 42  # I used 42 for the experiments
     problem, states = a1_problems()
     puzzle_no = 8  # For the 8-puzzle, this is set to 8
     strengths = [7, 5, 3]
+    workers = os.cpu_count()  # Processes used to construct PDBs
 
-    # WARNING: This will use up hundreds of megabytes with default settings.
-    # It will save a couple of minutes' execution next time, however.
-    # Choose wisely.
+    # Saves PDBs to the PDBs directory (a few megabytes with default settings)
+    # so that they need not be constructed next time.
     if use_file:
-        pdbs = get_pdbs("PDBs.txt", puzzle_no, strengths, problem)
+        pdbs = get_pdbs("PDBs", puzzle_no, strengths, problem, workers)
     else:
-        pdbs = make_pdbs(puzzle_no, strengths, problem)
+        pdbs = make_pdbs(puzzle_no, strengths, problem, workers)
 
+    # Results are also streamed to Results.csv as they are found
     print("Running experiments...")
-    results = run_experiments(states, problem, puzzle_no, strengths, sizes,
-                              pdbs)
+    fields = ["size", "strength", "problem", "mean", "stdev"]
+    with results.open_sink("Results.csv", fields) as sink:
+        experiment_results = run_experiments(states, problem, puzzle_no,
+                                             strengths, sizes, pdbs,
+                                             seed=seed, sink=sink)
     print("Experiments finished. Recording results...")
-    write_to_excel(results, "ExperimentalData.xlsx", "Sheet1")
+    write_to_excel(experiment_results, "ExperimentalData.xlsx", "Sheet1")
     print("Done!")
 
 
@@ -1,16 +1,21 @@
+import concurrent.futures
 import math
 import os
 import statistics
 import string
 import sys
-from typing import Any, Union
+from collections.abc import Iterator
+from typing import Any, Optional, Union
 import matplotlib.pyplot as plt
 
 import openpyxl
 
 sys.path.append(os.path.relpath("../"))
+import heuristics
 import problems
+import results
 import search
+import solution_cache
 
 Number = Union[int, float]
 
@@ -27,64 +32,205 @@ def rho(bound1, bound2, cost, c_star):
         return 1
 
 
-def main():
+worker_problem = None  # The problem space used by worker processes
+worker_heuristic = None  # Its heuristic
+
+
+def start_worker(goal: str, cache_heuristic: bool = False):
+    """Builds the problem space (and so its heuristic) once per worker.
+    If cache_heuristic is True, the heuristic's values are cached across the
+    worker's jobs (see heuristics.CachedHeuristic)."""
+    global worker_problem, worker_heuristic
+    worker_problem = problems.TileProblem(goal)
+    worker_heuristic = worker_problem.manhattan_distance
+    if cache_heuristic:
+        worker_heuristic = heuristics.CachedHeuristic(worker_heuristic)
+
+
+def solve(job: tuple[Optional[Number], bytes]) -> Union[tuple, dict]:
+    """Given a (weight, state) job, runs weighted A* with bounds on it.
+    If the weight is None, runs anytime weighted A* with every weight
+    instead, returning a dict of results by weight."""
+    w, state = job
+    if w is None:
+        return search.anytime_weighted_a_star(state, worker_problem,
+                                              worker_heuristic, weights)
+    return search.weighted_a_star_with_bounds(state, worker_problem,
+                                              worker_heuristic, w)
+
+
+def run_jobs(goal: str,
+             jobs: list[tuple[Optional[Number], bytes]],
+             workers: int = 1,
+             cache_heuristic: bool = False) -> Iterator[Union[tuple, dict]]:
+    """Solves (weight, state) jobs for the given goal, spread over a pool of
+    worker processes. Yields the results in the same order as the jobs, each
+    as soon as it (and every job before it) is finished."""
+    if workers == 1:
+        start_worker(goal, cache_heuristic)
+        yield from map(solve, jobs)
+        return
+    with concurrent.futures.ProcessPoolExecutor(
+            workers, initializer=start_worker,
+            initargs=(goal, cache_heuristic)) as executor:
+        yield from executor.map(solve, jobs)
+
+
+def run_cached_jobs(goal: str,
+                    jobs: list[tuple[Number, bytes]],
+                    cache: solution_cache.SolutionCache,
+                    workers: int = 1,
+                    cache_heuristic: bool = False) -> Iterator[tuple]:
+    """Like run_jobs, but jobs whose results are in the cache are not solved
+    again, and the results of the rest are stored in it."""
+    problem = problems.TileProblem(goal)
+    h = problem.manhattan_distance  # Identified as the workers' heuristic
+    keys = [
+        cache.key("weighted_a_star_with_bounds", state, problem, h, w)
+        for w, state in jobs
+    ]
+    found = [cache.get(key) for key in keys]
+    missing = [job for job, result in zip(jobs, found) if result is None]
+    if len(missing) < len(jobs):
+        print(f"{len(jobs) - len(missing)} results found in the cache")
+    solved = run_jobs(goal, missing, workers, cache_heuristic)
+    for key, result in zip(keys, found):
+        if result is None:
+            result = next(solved)
+            cache.put(key, result)
+        yield result
+
+
+def run_anytime_jobs(goal: str,
+                     problem_sets: dict[Number, list[bytes]],
+                     workers: int = 1,
+                     cache_heuristic: bool = False) -> Iterator[tuple]:
+    """Solves every problem once with anytime weighted A*, reusing each
+    weight's search for the next. Yields results in the same order as
+    run_jobs would for a job per C*, weight and problem, in that order."""
+    jobs = [(None, state) for states in problem_sets.values()
+            for state in states]
+    solved = run_jobs(goal, jobs, workers, cache_heuristic)
+    for states in problem_sets.values():
+        # A problem's results come all at once, so each C* is gathered first
+        set_results = [next(solved) for _ in states]
+        for w in weights:
+            for state_results in set_results:
+                yield state_results[w]
+
+
+headings = [
+    "Problem", "C", "C/C*", "F/Iter", "g_min/Iter", "FBound", "XBound",
+    "FB/XB", "Exceptn"
+]
+
+
+def result_row(problem_number: int, c_star: Number, result: tuple) -> list:
+    """Given a problem's result, returns its row of the results workbook."""
+    C, _, F, f_iter, g_min, g_iter, f_bound, x_bound = result
+    exception = "XXX" if f_bound < x_bound else None
+    return [
+        problem_number, C, C / c_star, f"{F}/{f_iter}", f"{g_min}/{g_iter}",
+        f_bound, x_bound, f_bound / x_bound, exception
+    ]
+
+
+def open_workbook(filename: str) -> results.ExcelSink:
+    """Opens a results workbook for one weight and set of problems."""
+    Side = openpyxl.styles.borders.Side
+    border_style = openpyxl.styles.borders.Border(right=Side(style="medium"),
+                                                  bottom=Side(style="medium"))
+    return results.ExcelSink(filename, headings, header_border=border_style)
+
+
+def close_workbook(workbook: results.ExcelSink):
+    """Adds mean and standard deviation rows below a workbook's results, and
+    saves it."""
+    last_row = workbook.rows + 1
+    summaries = [["mean"], ["SD"]]
+    for index in range(1, len(headings)):
+        if index in [3, 4, 8]:  # Not numeric
+            for summary in summaries:
+                summary.append(None)
+            continue
+        letter = string.ascii_uppercase[index]
+        cells = f"{letter}2:{letter}{last_row}"
+        summaries[0].append(f"=AVERAGE({cells})")
+        summaries[1].append(f"=STDEVPA({cells})")
+    for summary in summaries:
+        workbook.write(summary)
+    workbook.close()
+
+
+def main(workers=None,
+         anytime=False,
+         use_cache=True,
+         validate=False,
+         cache_heuristic=False):
     """Performs data generation for Assignment 2.
     Assumes GoalState.txt and Problems[C*].txt are in the same directory,
     in the form they were provided on Canvas.
+    Every (C*, W, problem) cell is solved independently, by a pool of worker
+    processes (one per CPU by default). Results are streamed to Results.csv
+    as they come in, so they survive an interrupted run, and each workbook
+    is saved as soon as its last problem is solved.
+    If anytime is True, each problem is instead solved once for all weights
+    with anytime weighted A*, which takes far fewer expansions, though its
+    results for smaller weights differ from weighted A*'s.
+    If use_cache is True, weighted A* results are kept in Solutions.sqlite3,
+    so that running this again (with the same code) solves nothing.
+    If validate is True, every result is checked against the exact goal
+    distances of every state (kept in Oracle.pdb), and any faults printed.
+    If cache_heuristic is True, each worker caches its heuristic's values.
+    Manhattan distance is cheap enough that this does not pay off, so it is
+    only worth turning on for a costlier heuristic.
     """
+    if workers is None:
+        workers = os.cpu_count()
 
     with open("GoalState.txt") as file:
         goal = file.read().strip()
     problem = problems.TileProblem(goal)
-    h = problem.manhattan_distance
-
-    Side = openpyxl.styles.borders.Side
-    border_style = openpyxl.styles.borders.Border(right=Side(style="medium"),
-                                                  bottom=Side(style="medium"))
-    headings = [
-        "Problem", "C", "C/C*", "F/Iter", "g_min/Iter", "FBound", "XBound",
-        "FB/XB", "Exceptn"
-    ]
 
+    problem_sets = {}  # Encoded states for each C*
+    cells = []  # (C*, W, encoded states) for each workbook
     for c_star in c_stars:
-        with open(f"Problems{c_star}.txt") as file:
-            contents = file.readlines()
-        states = [state.strip() for state in contents]
+        states = problem.load_states(f"Problems{c_star}.txt")
+        problem_sets[c_star] = states
         for w in weights:
-            print(f"Analysing problems with C*={c_star} using W={w}")
-            filename = f"Results{c_star}.{w:02}.xlsx"
-
-            workbook = openpyxl.Workbook()
-            sheet = workbook.active
-            sheet.title = "Sheet1"
-
-            for index, heading in enumerate(headings):
-                letter = string.ascii_uppercase[index]
-                sheet[f"{letter}1"] = heading
-                sheet[f"{letter}1"].border = border_style
-                if index not in [3, 4, 8]:
-                    sheet[f"{letter}27"] = f"=AVERAGE({letter}2:{letter}26)"
-                    sheet[f"{letter}28"] = f"=STDEVPA({letter}2:{letter}26)"
-
-            sheet["A27"] = "mean"
-            sheet["A28"] = "SD"
-
-            for problem_number, state in enumerate(states):
-                results = search.weighted_a_star_with_bounds(
-                    state, problem, h, w)
-                C, _, F, f_iter, g_min, g_iter, f_bound, x_bound = results
-                inputs = [
-                    problem_number + 1, C, C / c_star, f"{F}/{f_iter}",
-                    f"{g_min}/{g_iter}", f_bound, x_bound, f_bound / x_bound
-                ]
-
-                for index, cell_contents in enumerate(inputs):
-                    letter = string.ascii_uppercase[index]
-                    sheet[f"{letter}{problem_number + 2}"] = cell_contents
-                if f_bound < x_bound:
-                    sheet[f"I{problem_number + 2}"] = "XXX"
-
-            workbook.save(filename)
+            cells.append((c_star, w, states))
+
+    jobs = [(w, state) for _, w, states in cells for state in states]
+    print(f"Solving {len(jobs)} problems using {workers} worker(s)")
+    cache = None
+    if anytime:
+        solved = run_anytime_jobs(goal, problem_sets, workers,
+                                  cache_heuristic)
+    elif use_cache:
+        cache = solution_cache.SolutionCache("Solutions.sqlite3")
+        solved = run_cached_jobs(goal, jobs, cache, workers, cache_heuristic)
+    else:
+        solved = run_jobs(goal, jobs, workers, cache_heuristic)
+
+    oracle = None
+    if validate:
+        oracle = heuristics.GoalDistanceOracle(problem, "Oracle.pdb")
+
+    with results.open_sink("Results.csv", ["C*", "W"] + headings) as sink:
+        for c_star, w, states in cells:
+            print(f"Recording problems with C*={c_star} using W={w}")
+            workbook = open_workbook(f"Results{c_star}.{w:02}.xlsx")
+            for problem_number, state in enumerate(states, 1):
+                result = next(solved)
+                if oracle is not None:
+                    for fault in oracle.validate(state, result, w):
+                        print(f"Problem {problem_number}: {fault}")
+                row = result_row(problem_number, c_star, result)
+                sink.write([c_star, w] + row)
+                workbook.write(row)
+            close_workbook(workbook)
+    if cache is not None:
+        cache.close()
 
 
 if __name__ == "__main__":
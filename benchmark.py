@@ -0,0 +1,250 @@
+"""Benchmarks the searches over the problem sets shipped for both assignments.
+
+Each case is run in a fresh process, so that its peak memory use can be
+measured. Results are printed as JSON, and can be saved as a baseline for
+later runs to be compared against.
+
+Usage:
+    python benchmark.py [--output FILE] [--save-baseline FILE]
+                        [--baseline FILE] [--tolerance 0.2] [--repeat N]
+                        [--cases NAME ...]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from typing import Optional
+
+import problems
+import search
+
+directory = os.path.dirname(os.path.abspath(__file__))
+problem_sets = {
+    "a1": ("assignment1", "Problems.txt"),
+    "a2-10": ("assignment2", "Problems10.txt"),
+    "a2-15": ("assignment2", "Problems15.txt"),
+    "a2-20": ("assignment2", "Problems20.txt"),
+}
+weights = [4, 8, 16, 24]
+strengths = [7, 5, 3]
+sampling_strengths = [7, 5]  # Strength 3's PDBs take too long to set up
+
+
+def load_problem_set(
+        name: str) -> tuple[problems.TileProblem, list[bytes]]:
+    """Given the name of a problem set, returns its problem and encoded
+    states."""
+    folder, filename = problem_sets[name]
+    with open(os.path.join(directory, folder, "GoalState.txt")) as file:
+        problem = problems.TileProblem(file.read().strip())
+    states = problem.load_states(os.path.join(directory, folder, filename))
+    return problem, states
+
+
+def search_case(problem_set: str, heuristic: str,
+                weight: Optional[int]) -> Callable[[], int]:
+    """Sets up a case solving every problem in a set, with a_star if weight
+    is None and weighted_a_star otherwise. The returned function runs the
+    case and returns the number of nodes expanded."""
+    problem, states = load_problem_set(problem_set)
+    h = problem.manhattan_distance
+    if heuristic == "null":
+        h = search.null_heuristic
+
+    def run() -> int:
+        stats = search.SearchStats()
+        for state in states:
+            if weight is None:
+                search.a_star(state, problem, h, stats)
+            else:
+                search.weighted_a_star(state, problem, h, weight, stats)
+        return stats.expansions
+
+    return run
+
+
+def make_pdb_case(strength: int) -> Callable[[], int]:
+    """Sets up a case constructing the PDB for the first pattern of a given
+    strength for the Assignment 1 problem."""
+    sys.path.append(os.path.join(directory, "assignment1"))
+    import main as assignment1
+
+    problem, _ = load_problem_set("a1")
+    pattern = assignment1.choose_n(8, strength)[0]
+    goal = problem.abstract(problem.goal,
+                            assignment1.pattern_table(problem, pattern))
+
+    def run() -> int:
+        stats = search.SearchStats()
+        search.make_pdb(goal, problem, stats)
+        return stats.expansions
+
+    return run
+
+
+def external_pdb_case(strength: int,
+                      memory_budget: int) -> Callable[[], int]:
+    """Sets up a case constructing the PDB for the first pattern of a given
+    strength for the Assignment 1 problem with make_pdb_external, under a
+    memory budget small enough to split its layers into several runs."""
+    sys.path.append(os.path.join(directory, "assignment1"))
+    import main as assignment1
+
+    problem, _ = load_problem_set("a1")
+    pattern = assignment1.choose_n(8, strength)[0]
+    goal = problem.abstract(problem.goal,
+                            assignment1.pattern_table(problem, pattern))
+
+    def run() -> int:
+        stats = search.SearchStats()
+        with tempfile.TemporaryDirectory() as workspace:
+            search.make_pdb_external(goal, problem,
+                                     os.path.join(workspace, "case.pdb"),
+                                     memory_budget, workspace, stats)
+        return stats.expansions
+
+    return run
+
+
+def sampling_case() -> Callable[[], None]:
+    """Sets up a case running the Assignment 1 heuristic-sampling
+    experiments (not counting the time taken to construct PDBs)."""
+    sys.path.append(os.path.join(directory, "assignment1"))
+    import main as assignment1
+
+    problem, states = load_problem_set("a1")
+    pdbs = assignment1.make_pdbs(8, sampling_strengths, problem)
+
+    def run() -> None:
+        assignment1.run_experiments(states, problem, 8, sampling_strengths,
+                                    assignment1.sizes, pdbs, seed=42)
+
+    return run
+
+
+def all_cases() -> dict[str, Callable[[], Callable]]:
+    """Returns a function setting up each case, by name."""
+    cases = {}
+    for problem_set in problem_sets:
+        for heuristic in ["null", "manhattan"]:
+            cases[f"a_star/{heuristic}/{problem_set}"] = (
+                lambda p=problem_set, h=heuristic: search_case(p, h, None))
+        for weight in weights:
+            cases[f"weighted_a_star/w{weight}/{problem_set}"] = (
+                lambda p=problem_set, w=weight: search_case(
+                    p, "manhattan", w))
+    for strength in strengths:
+        cases[f"make_pdb/strength{strength}"] = (
+            lambda s=strength: make_pdb_case(s))
+    cases["make_pdb_external/strength3/budget4096"] = (
+        lambda: external_pdb_case(3, 4096))
+    cases["run_experiments"] = sampling_case
+    return cases
+
+
+def peak_rss_kb() -> Optional[int]:
+    """Returns the peak resident memory of this process in KB, if known."""
+    try:
+        import resource
+    except ImportError:  # Not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":  # Reported in bytes rather than KB
+        peak //= 1024
+    return peak
+
+
+def run_case(name: str, repeat: int = 1) -> dict:
+    """Runs a case in this process, returning its measurements. The fastest
+    of several repeats is kept."""
+    run = all_cases()[name]()
+    wall_time = float("inf")
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        nodes = run()
+        wall_time = min(wall_time, time.perf_counter() - begin)
+    result = {"wall_time": wall_time, "nodes": nodes, "nodes_per_sec": None}
+    if nodes is not None and wall_time > 0:
+        result["nodes_per_sec"] = nodes / wall_time
+    result["peak_rss_kb"] = peak_rss_kb()
+    return result
+
+
+def run_in_subprocess(name: str, repeat: int = 1) -> dict:
+    """Runs a case in a fresh process, so that its peak memory use is its
+    own, and returns its measurements."""
+    command = [
+        sys.executable,
+        os.path.abspath(__file__), "--run-case", name, "--repeat",
+        str(repeat)
+    ]
+    completed = subprocess.run(command,
+                               capture_output=True,
+                               text=True,
+                               check=True,
+                               cwd=directory)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Returns a description of each case that is slower than its baseline
+    by more than the given fraction."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old_time = baseline[name]["wall_time"]
+        new_time = result["wall_time"]
+        if new_time > old_time * (1 + tolerance):
+            regressions.append(f"{name}: {new_time:.3f}s, up from "
+                               f"{old_time:.3f}s in the baseline")
+    return regressions
+
+
+def main(arguments: Optional[list[str]] = None) -> int:
+    """Runs the benchmarks. Returns 1 if any case has regressed against the
+    baseline, and 0 otherwise."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cases", nargs="*", help="Names of cases to run")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--output", help="File to write results to")
+    parser.add_argument("--baseline", help="Baseline file to compare with")
+    parser.add_argument("--save-baseline", help="File to save results to")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    arguments = parser.parse_args(arguments)
+
+    if arguments.run_case:
+        print(json.dumps(run_case(arguments.run_case, arguments.repeat)))
+        return 0
+
+    names = arguments.cases or list(all_cases())
+    results = {}
+    for name in names:
+        print(f"Running {name}...", file=sys.stderr)
+        results[name] = run_in_subprocess(name, arguments.repeat)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    for filename in [arguments.output, arguments.save_baseline]:
+        if filename:
+            with open(filename, "w") as file:
+                file.write(output + "\n")
+
+    if arguments.baseline:
+        with open(arguments.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, arguments.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,345 @@
+import os
+from collections import OrderedDict
+from collections.abc import Callable, Iterable
+from typing import Any, Optional
+
+import search
+from pattern_databases import PatternDatabase
+from problems import Number, TileProblem, infinity
+
+
+class AdditivePDBHeuristic:
+    def __init__(self,
+                 problem: TileProblem,
+                 partitions: list[list[Iterable]],
+                 directory: Optional[str] = None):
+        """Initiates a heuristic made from additive, disjoint PDBs.
+        Each group of tiles gets a PDB in which all other tiles are treated
+        as blanks, so it only counts moves of the group's own tiles. As no
+        move is counted by two groups in the same partition, their values
+        can be added together without overestimating. Values from different
+        partitions are combined by taking the largest.
+
+        Args:
+            problem: The tile problem.
+            partitions: A list of partitions, each a list of disjoint groups
+                of tiles (e.g. [[[1, 2, 3, 4], [5, 6, 7, 8]]]).
+            directory: Optionally, a directory in which to save the PDBs, and
+                from which to load them next time.
+        """
+        self.partitions = []  # Lists of (table, PDB) pairs
+        # Names the heuristic, for caching results that depend on it
+        self.identity = "additive-pdb-" + repr(
+            [[[str(tile) for tile in group] for group in partition]
+             for partition in partitions])
+        for partition in partitions:
+            groups = []
+            seen = set()
+            for group in partition:
+                tiles = [str(tile) for tile in group]
+                if seen.intersection(tiles):
+                    raise ValueError(f"Groups in {partition} are not disjoint")
+                seen.update(tiles)
+                table = self.group_table(problem, tiles)
+                pdb = self.group_pdb(problem, tiles, table, directory)
+                groups.append((table, pdb))
+            self.partitions.append(groups)
+
+    def group_table(self, problem: TileProblem, tiles: list[str]) -> bytes:
+        """Given a group of tiles, returns a table for bytes.translate that
+        blanks out every other tile in an encoded state."""
+        return problem.abstraction({
+            tile: None
+            for tile in problem.tile_codes if tile not in tiles
+        })
+
+    def group_pdb(self, problem: TileProblem, tiles: list[str], table: bytes,
+                  directory: Optional[str]) -> PatternDatabase:
+        """Constructs (or loads, if saved before) the PDB for a group."""
+        goal = problem.abstract(problem.goal, table)
+        filename = None
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            name = "additive-" + "-".join(tiles) + ".pdb"
+            filename = os.path.join(directory, name)
+            if os.path.isfile(filename):
+                pdb = PatternDatabase.load(filename)
+                if pdb.goal == goal:
+                    return pdb
+
+        pdb = search.make_pdb(goal, problem)
+        pdb.pattern = tuple(tiles)
+        if filename is not None:
+            pdb.save(filename)
+        return pdb
+
+    def __call__(self, state: bytes) -> Number:
+        """Given an encoded state, returns the largest over all partitions of
+        the sum of the partition's PDB values."""
+        best = 0
+        for groups in self.partitions:
+            total = 0
+            for table, pdb in groups:
+                total += pdb.distances[pdb.ranker.rank(state.translate(table))]
+            if total > best:
+                best = total
+        return best
+
+
+class CachedHeuristic:
+    def __init__(self,
+                 heuristic: Callable[[Any], Number],
+                 max_size: Optional[int] = 1_000_000):
+        """Initiates a heuristic that remembers the values of another, so that
+        states generated again (in the same search or in later ones) are not
+        evaluated again. Least recently used values are forgotten once the
+        cache is full.
+        Only worthwhile for heuristics that are costly to evaluate: looking
+        up a value costs about as much as computing Manhattan distance.
+        Values are those of the cached heuristic, so they are only valid for
+        the problem (and goal) it was made for. To search a different one,
+        cache a heuristic made for it instead.
+
+        Args:
+            heuristic: The heuristic to cache. If it has an update method, it
+                is used to compute values missing from the cache.
+            max_size: The most values to keep, or None for no limit.
+        """
+        self.heuristic = heuristic
+        self.max_size = max_size
+        self.values = OrderedDict()  # Value of each encoded state
+        self.hits = 0
+        self.misses = 0
+        self._update = getattr(heuristic, "update", None)
+
+    def clear(self):
+        """Forgets all values and resets the hit and miss counts."""
+        self.values.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def store(self, state, value: Number):
+        """Remembers a state's value, forgetting the least recently used
+        value if the cache is full."""
+        self.values[state] = value
+        if self.max_size is not None and len(self.values) > self.max_size:
+            self.values.popitem(last=False)
+
+    def __call__(self, state) -> Number:
+        value = self.values.get(state)
+        if value is not None:
+            self.hits += 1
+            self.values.move_to_end(state)
+            return value
+        self.misses += 1
+        value = self.heuristic(state)
+        self.store(state, value)
+        return value
+
+    def update(self, parent, parent_value: Number, child) -> Number:
+        """Given a state, its heuristic value and a child state, returns the
+        child's heuristic value, computing it incrementally if it is not
+        cached and the underlying heuristic can."""
+        value = self.values.get(child)
+        if value is not None:
+            self.hits += 1
+            self.values.move_to_end(child)
+            return value
+        self.misses += 1
+        if self._update is None:
+            value = self.heuristic(child)
+        else:
+            value = self._update(parent, parent_value, child)
+        self.store(child, value)
+        return value
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def hit_rate(self) -> float:
+        """Returns the fraction of lookups answered from the cache."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def summary(self) -> str:
+        """Returns a one-line description of the cache's use."""
+        return (f"{len(self.values)} values cached, {self.hits} hits, "
+                f"{self.misses} misses ({self.hit_rate():.1%} hit rate)")
+
+
+class GoalDistanceOracle:
+    def __init__(self, problem: TileProblem, filename: Optional[str] = None):
+        """Initiates a table of every state's exact distance to the goal,
+        made by one breadth-first search backwards from the goal (as for a
+        PDB with no tiles merged). Any number of states sharing the goal can
+        then be solved optimally by looking them up, which makes the table a
+        ground truth for checking other searches. Only practical for small
+        problems: the 8-puzzle's table takes 9! bytes.
+
+        Args:
+            problem: The tile problem. Moves must be reversible, so that
+                distances from the goal are also distances to it.
+            filename: Optionally, a PDB file from which to load the table,
+                or in which to save it if the file is missing or was made
+                for a different goal.
+        """
+        self.problem = problem
+        self.identity = "goal-distance-oracle"
+        pdb = None
+        if filename is not None and os.path.isfile(filename):
+            pdb = PatternDatabase.load(filename)
+            if pdb.goal != problem.goal:
+                pdb = None
+        if pdb is None:
+            pdb = search.make_pdb(problem.goal, problem)
+            if filename is not None:
+                pdb.save(filename)
+        self.pdb = pdb
+
+    def __call__(self, state: bytes) -> Number:
+        """Given an encoded state, returns its exact distance to the goal
+        (infinity if it cannot reach it). Can be used as a heuristic."""
+        return self.pdb.get(state, infinity)
+
+    def cost(self, state) -> Number:
+        """Given a state, returns the cost of an optimal path to the goal."""
+        return self(self.problem.encode(state))
+
+    def costs(self, states: Iterable) -> list[Number]:
+        """Returns the optimal cost of each of the given states."""
+        return [self.cost(state) for state in states]
+
+    def solve(self, state) -> tuple[Number, list]:
+        """Given a state, returns an optimal path to the goal, found by
+        always moving to a neighbour one step closer to it. Returns a tuple
+        of the form (cost, path), like search.a_star."""
+        current = self.problem.encode(state)
+        distance = self(current)
+        if distance == infinity:
+            return infinity, [None]
+        cost = distance
+        path = [current]
+        while distance:
+            for _, neighbour in self.problem.successors(current):
+                if self(neighbour) == distance - 1:
+                    break
+            current = neighbour
+            distance -= 1
+            path.append(current)
+        return cost, search.decode_path(path, self.problem)
+
+    def validate(self, state, result: tuple, w: Number = 1) -> list[str]:
+        """Checks a search's result for a state against the optimal cost.
+
+        Args:
+            state: The state searched from.
+            result: A tuple starting with (cost, path), as returned by the
+                searches. If it is as long as weighted_a_star_with_bounds's,
+                its F and X bounds are checked too.
+            w: The weight the search was guaranteed to be within.
+
+        Returns:
+            A description of each problem found (empty if there are none).
+            The F bound is not guaranteed to hold, so its failures are
+            reported but do not imply a fault in the search.
+        """
+        faults = []
+        c_star = self.cost(state)
+        cost, path = result[:2]
+        if cost < c_star:
+            faults.append(f"Cost {cost} is below the optimal {c_star}")
+        if cost > w * c_star:
+            faults.append(f"Cost {cost} is over {w} times the optimal "
+                            f"{c_star}")
+
+        encoded = [self.problem.encode(step) for step in path]
+        if encoded[0] != self.problem.encode(state):
+            faults.append("Path does not begin at the start state")
+        if not self.problem.is_goal_state(encoded[-1]):
+            faults.append("Path does not end at the goal")
+        path_cost = 0
+        for before, after in zip(encoded, encoded[1:]):
+            step_costs = [
+                distance
+                for distance, neighbour in self.problem.successors(before)
+                if neighbour == after
+            ]
+            if not step_costs:
+                faults.append("Path contains an impossible move")
+                break
+            path_cost += min(step_costs)
+        else:
+            if path_cost > cost:
+                faults.append(f"Path costs {path_cost}, not {cost}")
+
+        if len(result) == 8 and c_star:
+            f_bound, x_bound = result[6:]
+            ratio = cost / c_star
+            if x_bound < ratio:
+                faults.append(f"X bound {x_bound} is below C/C* = {ratio}")
+            if f_bound < ratio:
+                faults.append(f"F bound {f_bound} is below C/C* = {ratio}")
+        return faults
+
+
+class SymmetricPatternDatabase:
+    def __init__(self, problem: TileProblem, pdb: PatternDatabase,
+                 table: bytes, symmetry: tuple[tuple[int, ...], bytes]):
+        """Initiates a view of a PDB that answers lookups for its mirror
+        image: the pattern a symmetry of the problem turns the PDB's pattern
+        into. Abstract states of the mirrored pattern are mapped back through
+        the symmetry and looked up in the PDB, so no second table is needed.
+
+        Args:
+            problem: The tile problem.
+            pdb: The PDB to look values up in.
+            table: The abstraction table the PDB was made with.
+            symmetry: The symmetry (from TileProblem.automorphisms) taking
+                states of the mirrored pattern to states of the PDB's.
+        """
+        self.problem = problem
+        self.pdb = pdb
+        self.table = table
+        self.symmetry = symmetry
+
+    def mirror(self, state: bytes) -> bytes:
+        """Given a state of the mirrored pattern, returns the matching
+        abstract state of the PDB's pattern."""
+        return self.problem.abstract(
+            self.problem.transform(state, self.symmetry), self.table)
+
+    def __getitem__(self, state: bytes) -> int:
+        return self.pdb[self.mirror(state)]
+
+    def __contains__(self, state: bytes) -> bool:
+        return self.mirror(state) in self.pdb
+
+    def get(self, state: bytes, default=None):
+        return self.pdb.get(self.mirror(state), default)
+
+
+class SymmetricHeuristic:
+    def __init__(self, heuristic: Callable[[Any], Number],
+                 problem: TileProblem):
+        """Initiates a heuristic that evaluates another on every symmetric
+        image of a state (see TileProblem.automorphisms), and returns the
+        largest value. As each image is as far from the goal as the state
+        itself, this is admissible whenever the other heuristic is, and at
+        least as strong.
+
+        Args:
+            heuristic: The heuristic to evaluate, taking encoded states.
+            problem: The tile problem.
+        """
+        self.heuristic = heuristic
+        self.problem = problem
+        self.symmetries = problem.automorphisms()
+        identity = getattr(heuristic, "identity", None)
+        if identity is not None:
+            self.identity = "symmetric-" + identity
+
+    def __call__(self, state: bytes) -> Number:
+        transform = self.problem.transform
+        return max(
+            self.heuristic(transform(state, symmetry))
+            for symmetry in self.symmetries)
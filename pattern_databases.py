@@ -0,0 +1,354 @@
+import json
+import math
+import mmap
+import operator
+import struct
+from typing import Optional
+
+UNREACHED = 255  # Distance stored for states not (yet) reached
+
+# PDB files start with MAGIC and the length of a JSON header, followed by the
+# header itself. The distance array starts at the next multiple of ALIGNMENT.
+MAGIC = b"PDB1"
+ALIGNMENT = 64
+
+
+def arrangements(counts: tuple[int, ...]) -> int:
+    """Given how many times each symbol appears, returns the number of
+    distinct arrangements of those symbols."""
+    total = math.factorial(sum(counts))
+    for count in counts:
+        total //= math.factorial(count)
+    return total
+
+
+class MultisetRanker:
+    scheme = "multiset-lexicographic"
+
+    def __init__(self, state: bytes):
+        """Initiates a perfect hash for every arrangement of the codes in an
+        encoded state. Codes may repeat (e.g. in an abstract state, where
+        several tiles share a code), in which case each distinct arrangement
+        gets one rank. Ranks are lexicographic, from 0 up to size - 1.
+
+        Args:
+            state: Any arrangement of the codes to be ranked.
+        """
+        self.length = len(state)
+        self.symbols = sorted(set(state))
+        counts = tuple(state.count(symbol) for symbol in self.symbols)
+        self.size = arrangements(counts)
+
+        # Each node stands for the codes not yet placed. For each code, steps
+        # holds the number of arrangements skipped by placing that code next,
+        # and the node reached by doing so (or None if none are left).
+        nodes = [counts]
+        node_ids = {counts: 0}
+        self.steps = []
+        width = self.symbols[-1] + 1
+        for remaining in nodes:  # Grows as new nodes are found
+            steps = [None] * width
+            offset = 0
+            for index, symbol in enumerate(self.symbols):
+                if not remaining[index]:
+                    continue
+                after = list(remaining)
+                after[index] -= 1
+                after = tuple(after)
+                if after not in node_ids:
+                    node_ids[after] = len(nodes)
+                    nodes.append(after)
+                steps[symbol] = (offset, node_ids[after])
+                offset += arrangements(after)
+            self.steps.append(steps)
+
+    def rank(self, state: bytes) -> int:
+        """Given an arrangement of the ranked codes, returns its rank."""
+        rank = 0
+        node = 0
+        steps = self.steps
+        for code in state:
+            offset, node = steps[node][code]
+            rank += offset
+        return rank
+
+    def unrank(self, rank: int) -> bytes:
+        """Given a rank, returns the arrangement with that rank."""
+        state = bytearray(self.length)
+        node = 0
+        steps = self.steps
+        descending = self.symbols[::-1]
+        for position in range(self.length):
+            for symbol in descending:
+                step = steps[node][symbol]
+                if step is not None and step[0] <= rank:
+                    break
+            offset, node = step
+            rank -= offset
+            state[position] = symbol
+        return bytes(state)
+
+
+def write_pdb_header(file, header: dict) -> int:
+    """Writes MAGIC, then the length of the JSON header, then the header,
+    padded so that the data after it starts at a multiple of ALIGNMENT.
+    Returns the offset at which the data starts."""
+    header = json.dumps(header).encode()
+    offset = len(MAGIC) + 4 + len(header)
+    padding = -offset % ALIGNMENT
+    file.write(MAGIC)
+    file.write(struct.pack("<I", len(header) + padding))
+    file.write(header + b" " * padding)
+    return offset + padding
+
+
+def write_pdb_file(filename: str, header: dict, data):
+    """Writes a PDB file: a header (see write_pdb_header), then the data."""
+    with open(filename, "wb") as file:
+        write_pdb_header(file, header)
+        file.write(data)
+
+
+def read_pdb_file(filename: str) -> tuple[dict, memoryview]:
+    """Memory-maps a PDB file written by write_pdb_file, returning its header
+    and a view of its data."""
+    with open(filename, "rb") as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapped[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{filename} is not a PDB file")
+    start = len(MAGIC) + 4
+    (header_length,) = struct.unpack("<I", mapped[len(MAGIC):start])
+    header = json.loads(mapped[start:start + header_length])
+    if header["ranking"] != MultisetRanker.scheme:
+        raise ValueError(f"Unknown ranking scheme {header['ranking']}")
+    offset = start + header_length
+    length = header.get("bytes", header["size"])  # Unless packed, 1 per rank
+    return header, memoryview(mapped)[offset:offset + length]
+
+
+class PatternDatabase:
+    def __init__(self,
+                 goal: bytes,
+                 distances: Optional[bytearray] = None,
+                 pattern: Optional[tuple] = None):
+        """Initiates a table of distances to an encoded goal state.
+        Distances are stored one byte per state, indexed by the state's rank
+        among all arrangements of the goal's codes, so states themselves are
+        never stored.
+
+        Args:
+            goal: The encoded goal state.
+            distances: The distance of each ranked state. If not given, all
+                states start out unreached. Can be any buffer of bytes, such
+                as a memoryview of a memory-mapped file.
+            pattern: Optionally, the tile IDs abstracted to make the goal.
+        """
+        self.goal = goal
+        self.pattern = pattern
+        self.ranker = MultisetRanker(goal)
+        if distances is None:
+            distances = bytearray([UNREACHED]) * self.ranker.size
+        elif len(distances) != self.ranker.size:
+            raise ValueError(f"Expected {self.ranker.size} distances, "
+                             f"got {len(distances)}")
+        self.distances = distances
+
+    def save(self, filename: str):
+        """Writes the PDB to a binary file that can be memory-mapped by load.
+        The file holds a header describing the pattern, goal and ranking
+        scheme, followed by the raw distance array."""
+        write_pdb_file(filename, self.header(), self.distances)
+
+    def header(self) -> dict:
+        """Returns the header describing the PDB in its file."""
+        return {
+            "pattern": self.pattern,
+            "goal": list(self.goal),
+            "ranking": self.ranker.scheme,
+            "size": self.ranker.size,
+        }
+
+    @classmethod
+    def create(cls,
+               filename: str,
+               goal: bytes,
+               pattern: Optional[tuple] = None) -> "PatternDatabase":
+        """Creates a PDB file with every state unreached, and returns a PDB
+        whose distances are memory-mapped from it for writing. The distances
+        never need to fit in memory, and changes to them go straight to the
+        file, which can then be opened with load."""
+        pdb = cls.__new__(cls)
+        pdb.goal = goal
+        pdb.pattern = pattern
+        pdb.ranker = MultisetRanker(goal)
+        size = pdb.ranker.size
+        with open(filename, "w+b") as file:
+            offset = write_pdb_header(file, pdb.header())
+            chunk = bytes([UNREACHED]) * min(size, 1 << 20)
+            for start in range(0, size, len(chunk)):
+                file.write(chunk[:size - start])
+            file.flush()
+            mapped = mmap.mmap(file.fileno(), 0)
+        pdb.distances = memoryview(mapped)[offset:offset + size]
+        return pdb
+
+    @classmethod
+    def load(cls, filename: str) -> "PatternDatabase":
+        """Opens a PDB file written by save. The distance array is memory-
+        mapped rather than read, so loading takes next to no time, only the
+        pages looked up are read from disk, and processes loading the same
+        file share its memory."""
+        header, distances = read_pdb_file(filename)
+        if "packing" in header:
+            raise ValueError(f"{filename} holds a compressed PDB")
+        pattern = header["pattern"]
+        if pattern is not None:
+            pattern = tuple(pattern)
+        return cls(bytes(header["goal"]), distances, pattern)
+
+    def __getitem__(self, state: bytes) -> int:
+        """Given an encoded state, returns its distance to the goal."""
+        distance = self.distances[self.ranker.rank(state)]
+        if distance == UNREACHED:
+            raise KeyError(state)
+        return distance
+
+    def __contains__(self, state: bytes) -> bool:
+        return self.distances[self.ranker.rank(state)] != UNREACHED
+
+    def __len__(self) -> int:
+        return self.ranker.size - bytes(self.distances).count(UNREACHED)
+
+    def get(self, state: bytes, default=None):
+        """Returns a state's distance to the goal, or default if the state
+        cannot reach the goal."""
+        distance = self.distances[self.ranker.rank(state)]
+        if distance == UNREACHED:
+            return default
+        return distance
+
+
+# Largest value a compressed PDB can hold. Larger distances (and unreached
+# states) are stored as this, which can only underestimate them.
+MAX_NIBBLE = 15
+# Tables for bytes.translate: capping distances at MAX_NIBBLE, and shifting
+# capped values into the high nibble
+capped = bytes(min(value, MAX_NIBBLE) for value in range(256))
+shifted = bytes((value << 4) & 0xFF for value in range(256))
+
+
+class CompressedPatternDatabase:
+    foldings = (None, "div", "mod")
+
+    def __init__(self,
+                 goal: bytes,
+                 packed,
+                 pattern: Optional[tuple] = None,
+                 folding: Optional[str] = None,
+                 factor: int = 1):
+        """Initiates a PDB holding each value in 4 bits, two to a byte.
+        Values are capped at MAX_NIBBLE. Optionally, several ranks can also
+        share (be folded into) one value, which is then the smallest of their
+        distances. Either way, values never overestimate, so heuristics using
+        them stay admissible. Use compress to make one from a PatternDatabase.
+
+        Args:
+            goal: The encoded goal state.
+            packed: The packed values, as bytes or any buffer of bytes.
+            pattern: Optionally, the tile IDs abstracted to make the goal.
+            folding: None to give each rank its own value, "div" to fold each
+                block of factor consecutive ranks into one value, or "mod" to
+                fold ranks that are equal modulo the number of values.
+            factor: The number of ranks folded into each value.
+        """
+        if folding not in self.foldings:
+            raise ValueError(f"Unknown folding {folding}")
+        if factor < 1 or (folding is None and factor != 1):
+            raise ValueError(f"Cannot fold by a factor of {factor}")
+        self.goal = goal
+        self.pattern = pattern
+        self.ranker = MultisetRanker(goal)
+        self.folding = folding
+        self.factor = factor
+        self.slots = -(-self.ranker.size // factor)  # Number of values
+        if len(packed) != (self.slots + 1) // 2:
+            raise ValueError(f"Expected {(self.slots + 1) // 2} bytes, "
+                             f"got {len(packed)}")
+        self.packed = packed
+
+    @classmethod
+    def compress(cls,
+                 pdb: PatternDatabase,
+                 folding: Optional[str] = None,
+                 factor: int = 1) -> "CompressedPatternDatabase":
+        """Given a PDB, returns a compressed copy of it. See __init__ for the
+        meaning of folding and factor."""
+        values = bytes(pdb.distances).translate(capped)
+        slots = -(-len(values) // factor)
+        padding = bytes([MAX_NIBBLE]) * (slots * factor - len(values))
+        values += padding
+        if folding == "div":
+            parts = [values[offset::factor] for offset in range(factor)]
+        elif folding == "mod":
+            parts = [
+                values[start:start + slots]
+                for start in range(0, len(values), slots)
+            ]
+        else:
+            parts = [values]
+        folded = parts[0]
+        for part in parts[1:]:
+            folded = bytes(map(min, folded, part))
+
+        if len(folded) % 2:
+            folded += bytes([MAX_NIBBLE])
+        packed = bytes(
+            map(operator.or_, folded[0::2], folded[1::2].translate(shifted)))
+        return cls(pdb.goal, packed, pdb.pattern, folding, factor)
+
+    def save(self, filename: str):
+        """Writes the PDB to a file in the same format as PatternDatabase,
+        with its packing and folding recorded in the header."""
+        write_pdb_file(filename, self.header(), self.packed)
+
+    def header(self) -> dict:
+        """Returns the header describing the PDB in its file."""
+        return {
+            "pattern": self.pattern,
+            "goal": list(self.goal),
+            "ranking": self.ranker.scheme,
+            "size": self.ranker.size,
+            "packing": "nibble",
+            "folding": self.folding,
+            "factor": self.factor,
+            "bytes": len(self.packed),
+        }
+
+    @classmethod
+    def load(cls, filename: str) -> "CompressedPatternDatabase":
+        """Opens a compressed PDB file written by save, memory-mapping its
+        values as PatternDatabase.load does."""
+        header, packed = read_pdb_file(filename)
+        if header.get("packing") != "nibble":
+            raise ValueError(f"{filename} does not hold a compressed PDB")
+        pattern = header["pattern"]
+        if pattern is not None:
+            pattern = tuple(pattern)
+        return cls(bytes(header["goal"]), packed, pattern, header["folding"],
+                   header["factor"])
+
+    def value(self, rank: int) -> int:
+        """Given a rank, returns the value stored for it."""
+        if self.folding == "div":
+            slot = rank // self.factor
+        elif self.folding == "mod":
+            slot = rank % self.slots
+        else:
+            slot = rank
+        byte = self.packed[slot >> 1]
+        return byte >> 4 if slot & 1 else byte & 0x0F
+
+    def __getitem__(self, state: bytes) -> int:
+        """Given an encoded state, returns a lower bound on its distance to
+        the goal."""
+        return self.value(self.ranker.rank(state))
@@ -1,9 +1,17 @@
 import itertools
+import operator
 import re
-from collections.abc import Iterable
-from typing import Any, Union
+from collections.abc import Iterable, Iterator
+from string import ascii_lowercase
+from typing import Any, Optional, Union
 
 Number = Union[int, float]
+infinity = float("inf")
+
+# Each match of a predicate regex captures the predicate's arguments
+at_regex = re.compile(r"\bat\(\s*([^,()]+?)\s*,\s*([^,()]+?)\s*\)")
+adj_regex = re.compile(r"\badj\(\s*([^,()]+?)\s*,\s*([^,()]+?)\s*\)")
+predicate_regexes = {"at": at_regex, "adj": adj_regex}
 
 
 class Problem:
@@ -15,6 +23,14 @@ class Problem:
         """Given a state, returns all neighbour states."""
         pass
 
+    def successors(self, state,
+                   parent=None) -> Iterator[tuple[Number, Any]]:
+        """Given a state, yields its neighbour states one at a time, leaving
+        out the state's parent (if given). Defaults to filtering expand."""
+        for distance, neighbour in self.expand(state):
+            if neighbour != parent:
+                yield distance, neighbour
+
     def is_goal_state(self, state) -> bool:
         """True if given state is a goal state."""
         pass
@@ -23,6 +39,26 @@ class Problem:
         """Returns a definitive version of the state."""
         pass
 
+    def goal_state(self):
+        """Returns the problem's single goal state (in the form given by
+        encode), or None if it does not have exactly one."""
+        return None
+
+    def encode(self, state):
+        """Converts a state into the representation used during search.
+        Defaults to the canonical version of the state."""
+        return self.canonical(state)
+
+    def decode(self, state):
+        """Converts a state used during search back into its usual form."""
+        return state
+
+    def sort_key(self, state):
+        """Given an encoded state, returns a value ordering it among others
+        as its canonical version would be ordered. Searches use this to
+        break ties between states of equal priority."""
+        return state
+
 
 class TileProblem(Problem):
     def __init__(self, text: str):
@@ -31,6 +67,11 @@ class TileProblem(Problem):
         States can contain adjacencies (adj), tile locations (at), and blanks.
         Internally, only locations are used - adjacencies stay constant.
 
+        During search, states are encoded as bytes objects with one byte per
+        location (in sorted order of location names). Each byte is the code of
+        the tile at that location, with 0 standing for a blank. Strings are
+        only needed to describe states going in and out of the problem.
+
         Args:
             text: The problem's goal state, with all adjacency and location
                 predicates.
@@ -43,14 +84,92 @@ class TileProblem(Problem):
         for first, second in adjacencies:
             self.adjacencies[first].add(second)
 
-        self.as_string = self.canonical(text)
-        self.distances = {} # Distances between given locations
+        self.locations = sorted(locations)
+        self.location_indices = {
+            location: index
+            for index, location in enumerate(self.locations)
+        }
 
-    def remove_brackets(self, string: str) -> str:
-        """Given a string with brackets, returns the brackets' contents."""
-        opening_index = string.index("(")
-        closing_index = string.index(")")
-        return string[opening_index + 1:closing_index]
+        pieces = {piece for piece, _ in self.predicate_lists(text, "at")}
+        # Code 0 is the blank. Sorting by length first keeps tile 10 after 9
+        self.tiles = [None] + sorted(pieces, key=lambda piece:
+                                     (len(piece), piece))
+        self.tile_codes = {
+            piece: code
+            for code, piece in enumerate(self.tiles) if piece is not None
+        }
+
+        # Canonical strings list 'at' predicates in sorted order, so they
+        # are ordered by the location of each tile in turn, taking tiles and
+        # locations in the order of the predicates' text (see sort_key)
+        tile_order = sorted(self.tiles[1:], key=lambda piece: piece + ",")
+        self.tile_order = bytearray(range(256))  # A table for translate
+        for rank, piece in enumerate(tile_order, 1):
+            self.tile_order[self.tile_codes[piece]] = rank
+        self.tile_order = bytes(self.tile_order)
+        location_order = sorted(self.locations,
+                                key=lambda location: location + ")")
+        self.location_order = None
+        if location_order != self.locations:
+            self.location_order = bytes(
+                location_order.index(location)
+                for location in self.locations)
+        self.location_range = range(len(self.locations))
+
+        # For each blank location, the locations whose tiles can move into it
+        self.moves = tuple(
+            tuple(self.location_indices[location]
+                  for location in self.locations
+                  if blank in self.adjacencies[location])
+            for blank in self.locations)
+
+        # Distances between all pairs of locations, by index
+        self.distances = [
+            self.location_distances(location) for location in self.locations
+        ]
+
+        self.goal = self.encode(text)
+        self.goal_locations = {
+            piece: location
+            for location, piece in enumerate(self.goal) if piece
+        }
+        self.as_string = self.decode(self.goal)
+        self.manhattan_distance = ManhattanDistance(self)
+
+    @classmethod
+    def grid(cls, width: int, height: Optional[int] = None) -> "TileProblem":
+        """Creates a sliding tile puzzle on a grid, such as grid(3) for the
+        8-puzzle or grid(4) for the 15-puzzle. Locations are named a, b, c...
+        (or aa, ab, ac... for more than 26) along each row in turn. The goal
+        has tiles 1, 2, 3... in that order, with the blank last.
+
+        Args:
+            width: The number of columns.
+            height: The number of rows. Defaults to the width.
+        """
+        if height is None:
+            height = width
+        size = width * height
+        name_length = 1 if size <= 26 else 2
+        names = [
+            "".join(letters) for letters in itertools.product(
+                ascii_lowercase, repeat=name_length)
+        ][:size]
+
+        predicates = []
+        for index, name in enumerate(names):
+            row, column = divmod(index, width)
+            for row_step, column_step in [(0, 1), (1, 0), (0, -1), (-1, 0)]:
+                new_row = row + row_step
+                new_column = column + column_step
+                if 0 <= new_row < height and 0 <= new_column < width:
+                    neighbour = names[new_row * width + new_column]
+                    predicates.append(f"adj({name},{neighbour})")
+        for index, name in enumerate(names[:-1]):
+            predicates.append(f"at({index + 1},{name})")
+        predicates.append(f"blank({names[-1]})")
+
+        return cls("state([" + ",".join(predicates) + "]).")
 
     def predicate_lists(self, string: str, predicate: str) -> list[list[str]]:
         """Given a string and a kind of predicate, returns a list of the
@@ -65,36 +184,78 @@ class TileProblem(Problem):
             of the given kind of predicate. For example, 'at(8, e)' becomes
             ('8', 'e').
         """
-        regex = predicate + r"\([^()]+\)"
-        matches = re.findall(regex, string)
-        split = []
-        for match in matches:
-            string = self.remove_brackets(match)
-            split.append(string.split(","))
-        return split
-
-    def str_to_dict(self, state: str) -> dict[str, Any]:
-        """Given a state string, returns a dict of all tile locations."""
-        location_lists = self.predicate_lists(state, "at")
-        locations = {location: None for location in self.adjacencies}
-        for piece, location in location_lists:
-            locations[location] = piece
-        return locations
-
-    def dict_to_str(self,
-                    locations: dict[str, Any],
-                    full: bool = False) -> str:
-        """Given a dict of tile locations, returns a state string.
+        regex = predicate_regexes.get(predicate)
+        if regex is not None:
+            return [list(match) for match in regex.findall(string)]
+        regex = re.compile(r"\b" + re.escape(predicate) + r"\(([^()]*)\)")
+        return [[argument.strip() for argument in match.split(",")]
+                for match in regex.findall(string)]
+
+    def encode(self, state: Union[str, bytes]) -> bytes:
+        """Given a state string, returns its encoded form.
+        States that are already encoded are returned as they are.
+
+        Raises:
+            ValueError: If the state has a tile the goal does not, or puts a
+                tile in an unknown location.
+        """
+        if isinstance(state, bytes):
+            return state
+        codes = bytearray(len(self.locations))
+        location_indices = self.location_indices
+        tile_codes = self.tile_codes
+        for piece, location in at_regex.findall(state):
+            code = tile_codes.get(piece)
+            if code is None:
+                raise ValueError(f"Unknown tile {piece!r}")
+            index = location_indices.get(location)
+            if index is None:
+                raise ValueError(f"Unknown location {location!r}")
+            codes[index] = code
+        return bytes(codes)
+
+    def load_states(self, filename: str) -> list[bytes]:
+        """Reads a file of states, one per line (such as a Problems file),
+        and returns them encoded, ready to be searched. Blank lines are
+        skipped.
+
+        Raises:
+            ValueError: If a state's adjacencies (where given) differ from
+                the problem's, or it has a tile the goal does not, or puts a
+                tile in an unknown location.
+        """
+        adjacencies = {(first, second)
+                       for first, seconds in self.adjacencies.items()
+                       for second in seconds}
+        states = []
+        with open(filename) as file:
+            for line_number, line in enumerate(file, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                line_adjacencies = set(adj_regex.findall(line))
+                if line_adjacencies and line_adjacencies != adjacencies:
+                    raise ValueError(f"{filename}, line {line_number}: "
+                                     "adjacencies differ from the goal's")
+                try:
+                    states.append(self.encode(line))
+                except ValueError as error:
+                    raise ValueError(
+                        f"{filename}, line {line_number}: {error}") from None
+        return states
+
+    def decode(self, state: bytes, full: bool = False) -> str:
+        """Given an encoded state, returns a state string.
         Can contain only 'at' predicates (for compactness) or full description.
 
         Args:
-            locations: Dictionary of tile locations.
+            state: The encoded state.
             full: If True, returns a complete state description, with
                 adjacencies, blanks, and a 'state' predicate encompassing the
                 rest. If False, returns only 'at' predicates.
 
         Returns:
-            A string describing the current state.
+            A string describing the state.
         """
         predicates = []
 
@@ -103,9 +264,9 @@ class TileProblem(Problem):
                 for second in seconds:
                     predicates.append(f"adj({first},{second})")
 
-        for location, piece in locations.items():
-            if piece is not None:
-                predicates.append(f"at({piece},{location})")
+        for location, code in zip(self.locations, state):
+            if code:
+                predicates.append(f"at({self.tiles[code]},{location})")
             elif full:
                 predicates.append(f"blank({location})")
 
@@ -119,9 +280,136 @@ class TileProblem(Problem):
     def canonical(self, state: str, full: bool = False) -> str:
         """Returns a definitive version of the state.
         Can return full description, but defaults to compact."""
-        dictionary = self.str_to_dict(state)
-        string = self.dict_to_str(dictionary, full)
-        return string
+        return self.decode(self.encode(state), full)
+
+    def sort_key(self, state: bytes) -> bytes:
+        """Given an encoded state, returns a key ordering it among others as
+        its canonical string would be ordered, without building the string:
+        the locations of the tiles, in the order their predicates appear."""
+        ordered = state.translate(self.tile_order)
+        locations = sorted(self.location_range, key=ordered.__getitem__)
+        del locations[:state.count(0)]  # Blanks are left out
+        if self.location_order is not None:
+            return bytes(map(self.location_order.__getitem__, locations))
+        return bytes(locations)
+
+    def abstraction(self, classes: dict[Any, Any]) -> bytes:
+        """Given a mapping from tiles to pattern classes, returns a table for
+        abstracting encoded states with abstract (or bytes.translate).
+        Works on tile codes, so tiles such as 1 and 10 are never confused.
+
+        Args:
+            classes: Maps tiles to the tile standing for their class (so
+                {1: 1, 2: 1, 3: 1} merges tiles 1-3), or to None to blank
+                them out. Tiles not included are left as they are.
+
+        Returns:
+            A 256-byte translation table.
+        """
+        table = bytearray(range(256))
+        for tile, pattern_class in classes.items():
+            code = self.tile_codes[str(tile)]
+            if pattern_class is None:
+                table[code] = 0
+            else:
+                table[code] = self.tile_codes[str(pattern_class)]
+        return bytes(table)
+
+    def abstract(self, state: bytes, table: bytes) -> bytes:
+        """Given an encoded state and a table from abstraction, returns the
+        abstracted state."""
+        return state.translate(table)
+
+    def automorphisms(self) -> list[tuple[tuple[int, ...], bytes]]:
+        """Returns the problem's symmetries: ways of moving every location
+        (keeping adjacencies the same) and relabelling every tile, that leave
+        the goal unchanged. A state and its image under a symmetry are the
+        same distance from the goal. The identity comes first.
+
+        Returns:
+            A list of (order, table) pairs, for use with transform. A state's
+            image has the tile at location order[i] (relabelled by the
+            translate table) at location i.
+        """
+        size = len(self.locations)
+        neighbours = [{
+            self.location_indices[neighbour]
+            for neighbour in self.adjacencies[location]
+        } for location in self.locations]
+        goal = self.goal
+        images = [None] * size  # Image of each location, once chosen
+        used = [False] * size
+        tile_images = {0: 0}  # Blanks stay blanks
+        tile_sources = {0: 0}
+        symmetries = []
+
+        def extend(location: int):
+            if location == size:
+                order = [0] * size
+                for source, image in enumerate(images):
+                    order[image] = source
+                table = bytearray(range(256))
+                for source, image in tile_images.items():
+                    table[source] = image
+                symmetries.append((tuple(order), bytes(table)))
+                return
+            for image in range(size):
+                if used[image] or (len(neighbours[image]) !=
+                                   len(neighbours[location])):
+                    continue
+                if any((other in neighbours[location]) !=
+                       (images[other] in neighbours[image]) or
+                       (location in neighbours[other]) !=
+                       (image in neighbours[images[other]])
+                       for other in range(location)):
+                    continue
+                tile, tile_image = goal[location], goal[image]
+                new_tile = tile not in tile_images
+                if new_tile and tile_image in tile_sources:
+                    continue  # Two tiles cannot swap to the same one
+                if tile_images.get(tile, tile_image) != tile_image:
+                    continue
+                images[location] = image
+                used[image] = True
+                if new_tile:
+                    tile_images[tile] = tile_image
+                    tile_sources[tile_image] = tile
+                extend(location + 1)
+                if new_tile:
+                    del tile_images[tile]
+                    del tile_sources[tile_image]
+                used[image] = False
+                images[location] = None
+
+        extend(0)
+        return symmetries
+
+    def transform(self, state: bytes,
+                  symmetry: tuple[tuple[int, ...], bytes]) -> bytes:
+        """Given an encoded state and a symmetry from automorphisms, returns
+        the state's image under the symmetry."""
+        order, table = symmetry
+        return bytes(map(state.__getitem__, order)).translate(table)
+
+    def invert(
+        self, symmetry: tuple[tuple[int, ...], bytes]
+    ) -> tuple[tuple[int, ...], bytes]:
+        """Returns the symmetry that undoes the given one."""
+        order, table = symmetry
+        inverse_order = [0] * len(order)
+        for location, source in enumerate(order):
+            inverse_order[source] = location
+        inverse_table = bytearray(range(256))
+        for code, image in enumerate(table):
+            inverse_table[image] = code
+        return tuple(inverse_order), bytes(inverse_table)
+
+    def symmetric_tiles(self, tiles: Iterable,
+                        symmetry: tuple[tuple[int, ...], bytes]) -> list[str]:
+        """Given some tiles, returns the tiles they are relabelled as by a
+        symmetry."""
+        table = symmetry[1]
+        return [self.tiles[table[self.tile_codes[str(tile)]]] for tile in tiles]
 
     def __str__(self):
         return self.as_string
@@ -132,66 +420,116 @@ class TileProblem(Problem):
     def __hash__(self):
         return hash(self.as_string)
 
-    def is_goal_state(self, state: str) -> bool:
-        """True if given state is a goal state."""
-        state = self.canonical(state)
-        return state == self.as_string
-
-    def blanks(self, locations: dict[str, Any]) -> set[str]:
-        """Given a location dict, returns a set of all blank locations."""
-        return {
-            location
-            for location, piece in locations.items() if piece is None
-        }
-
-    def expand(self, state: str) -> set[tuple[int, str]]:
-        """Given a state, returns all neighbour states."""
-        next_states = set()
-        locations = self.str_to_dict(state)
-        blanks = self.blanks(locations)
-        for blank in blanks:  # For our examples, only one blank
-            for location, piece in locations.items():
-                if blank in self.adjacencies[location]:
-                    new_locations = locations.copy()
-                    new_locations[blank] = piece
-                    new_locations[location] = None
-                    new_state = self.dict_to_str(new_locations)
-                    next_states.add((1, new_state))
+    def is_goal_state(self, state: bytes) -> bool:
+        """True if given encoded state is a goal state."""
+        return state == self.goal
+
+    def goal_state(self) -> bytes:
+        """Returns the encoded goal state."""
+        return self.goal
+
+    def expand(self, state: bytes) -> list[tuple[int, bytes]]:
+        """Given an encoded state, returns all neighbour states."""
+        next_states = []
+        blank = state.find(0)
+        while blank != -1:  # For our examples, only one blank
+            for location in self.moves[blank]:
+                piece = state[location]
+                if piece:
+                    new_state = bytearray(state)
+                    new_state[blank] = piece
+                    new_state[location] = 0
+                    next_states.append((1, bytes(new_state)))
+            blank = state.find(0, blank + 1)
         return next_states
 
-    def ensure_in_distance_dict(self, from_location, to_location):
-        key = f"{from_location}->{to_location}"
-        if key in self.distances:
-            return
-        current_nodes = {from_location}
+    def successors(
+            self,
+            state: bytes,
+            parent: Optional[bytes] = None) -> Iterator[tuple[int, bytes]]:
+        """Given an encoded state, yields its neighbour states one at a time,
+        without moving a tile straight back to where it came from in the
+        state's parent (if given)."""
+        blank = state.find(0)
+        while blank != -1:
+            for location in self.moves[blank]:
+                piece = state[location]
+                if not piece:
+                    continue
+                # Moving a piece back leaves it where it was in the parent
+                if (parent is not None and parent[location] == 0 and
+                        parent[blank] == piece):
+                    continue
+                new_state = bytearray(state)
+                new_state[blank] = piece
+                new_state[location] = 0
+                yield 1, bytes(new_state)
+            blank = state.find(0, blank + 1)
+
+    def location_distances(self, from_location: str) -> list[Number]:
+        """Given a location, returns the number of moves needed to get from it
+        to each location (by index), using a breadth-first search."""
+        distances = [infinity] * len(self.locations)
+        distances[self.location_indices[from_location]] = 0
+        current_nodes = [from_location]
         distance = 0
-        explored_nodes = set()
-        new_nodes = set()
-        while key not in self.distances:
-            for node in current_nodes:
-                new_key = f"{from_location}->{node}"
-                if new_key not in self.distances:
-                    self.distances[new_key] = distance
-                explored_nodes.add(node)
-                new_nodes.update(self.adjacencies[node])
-            current_nodes.update(new_nodes)
-            current_nodes.difference_update(explored_nodes)
+        while current_nodes:
             distance += 1
-                
+            new_nodes = []
+            for node in current_nodes:
+                for neighbour in self.adjacencies[node]:
+                    index = self.location_indices[neighbour]
+                    if distances[index] == infinity:
+                        distances[index] = distance
+                        new_nodes.append(neighbour)
+            current_nodes = new_nodes
+        return distances
 
-    def manhattan_distance(self, state: str) -> Number:
-        from_locations = self.str_to_dict(state)
-        locations = self.str_to_dict(self.as_string)
-        to_locations = {piece: location for location, piece in locations.items() if piece is not None}
 
-        distance = 0
+class ManhattanDistance:
+    def __init__(self, problem: TileProblem, target: Optional[bytes] = None):
+        """Initiates the Manhattan distance heuristic for a tile problem.
+        The distance from each location to each tile's goal location is
+        looked up once, so evaluating a state is a single pass over it.
 
-        for from_location, piece in from_locations.items():
-            if piece is None:
-                continue
-            to_location = to_locations[piece]
-            self.ensure_in_distance_dict(from_location, to_location)
-            key = f"{from_location}->{to_location}"
-            distance += self.distances[key]
+        Args:
+            problem: The tile problem.
+            target: Optionally, an encoded state to measure distances to
+                instead of the problem's goal state (for example, the start
+                state, when searching backwards from the goal).
+        """
+        # Names the heuristic, for caching results that depend on it
+        self.identity = "manhattan"
+        if target is None:
+            target = problem.goal
+        else:
+            self.identity += "-to-" + target.hex()
+        goal_locations = {
+            piece: location
+            for location, piece in enumerate(target) if piece
+        }
 
-        return distance
+        self.table = []  # Distance to each tile's goal, for each location
+        for distances in problem.distances:
+            row = [0] * len(problem.tiles)
+            for piece, goal_location in goal_locations.items():
+                row[piece] = distances[goal_location]
+            self.table.append(row)
+
+    def __call__(self, state: bytes) -> Number:
+        """Given an encoded state, returns the sum of all tiles' distances
+        from their goal locations."""
+        return sum(map(operator.getitem, self.table, state))
+
+    def update(self, parent: bytes, parent_value: Number,
+               child: bytes) -> Number:
+        """Given a state, its heuristic value and a child state reached by
+        moving one tile, returns the child's heuristic value.
+        Only the moved tile is looked at, unless there are several blanks."""
+        to_location = parent.find(0)
+        if parent.find(0, to_location + 1) != -1:
+            return self(child)
+        from_location = child.find(0)
+        piece = parent[from_location]
+        return (parent_value - self.table[from_location][piece] +
+                self.table[to_location][piece])
@@ -0,0 +1,135 @@
+"""Sinks that write experimental results one row at a time.
+
+Rows are written (and, for text formats, flushed) as soon as they are
+produced, so memory use stays flat however large a sweep is, and rows
+finished before an interrupted run are not lost.
+"""
+import csv
+import json
+import os
+from collections.abc import Sequence
+from typing import Any, Optional
+
+
+class ResultSink:
+    def __init__(self, filename: str, fields: Optional[Sequence[str]] = None):
+        """Initiates a sink writing rows of results to a file.
+        Can be used as a context manager, which closes the sink on exit.
+
+        Args:
+            filename: The file to write to. Any existing file is replaced.
+            fields: Optionally, the name of each column in a row.
+        """
+        self.filename = filename
+        self.fields = None if fields is None else list(fields)
+        self.rows = 0
+
+    def write(self, row: Sequence[Any]):
+        """Writes a row of values, in the same order as the fields."""
+        self.rows += 1
+
+    def close(self):
+        """Finishes writing the file."""
+        pass
+
+    def __enter__(self) -> "ResultSink":
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+
+class CSVSink(ResultSink):
+    def __init__(self, filename: str, fields: Optional[Sequence[str]] = None):
+        """Initiates a sink writing rows to a CSV file, starting with a row of
+        field names if given."""
+        super().__init__(filename, fields)
+        self.file = open(filename, "w", newline="")
+        self.writer = csv.writer(self.file)
+        if self.fields is not None:
+            self.writer.writerow(self.fields)
+            self.file.flush()
+
+    def write(self, row: Sequence[Any]):
+        super().write(row)
+        self.writer.writerow(row)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class JSONLinesSink(ResultSink):
+    def __init__(self, filename: str, fields: Optional[Sequence[str]] = None):
+        """Initiates a sink writing one JSON value per line. Rows are written
+        as objects keyed by field name if fields are given, and as lists
+        otherwise."""
+        super().__init__(filename, fields)
+        self.file = open(filename, "w")
+
+    def write(self, row: Sequence[Any]):
+        super().write(row)
+        if self.fields is not None:
+            row = dict(zip(self.fields, row))
+        else:
+            row = list(row)
+        self.file.write(json.dumps(row) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ExcelSink(ResultSink):
+    def __init__(self,
+                 filename: str,
+                 fields: Optional[Sequence[str]] = None,
+                 sheet_title: str = "Sheet1",
+                 header_border=None):
+        """Initiates a sink writing rows to an Excel workbook. The workbook is
+        opened in openpyxl's write-only mode, so rows are not kept as cells
+        in memory, but the file is only saved when the sink is closed.
+
+        Args:
+            filename: The workbook to write to.
+            fields: Optionally, headings for the first row.
+            sheet_title: The title of the workbook's only sheet.
+            header_border: Optionally, an openpyxl Border for the headings.
+        """
+        import openpyxl  # Only needed for Excel output
+
+        super().__init__(filename, fields)
+        self.workbook = openpyxl.Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet(sheet_title)
+        if self.fields is not None:
+            headings = []
+            for field in self.fields:
+                cell = openpyxl.cell.WriteOnlyCell(self.sheet, value=field)
+                if header_border is not None:
+                    cell.border = header_border
+                headings.append(cell)
+            self.sheet.append(headings)
+
+    def write(self, row: Sequence[Any]):
+        super().write(row)
+        self.sheet.append(list(row))
+
+    def close(self):
+        self.workbook.save(self.filename)
+
+
+sink_types = {
+    ".csv": CSVSink,
+    ".jsonl": JSONLinesSink,
+    ".xlsx": ExcelSink,
+}
+
+
+def open_sink(filename: str,
+              fields: Optional[Sequence[str]] = None) -> ResultSink:
+    """Returns a sink for a file, chosen by its extension (.csv, .jsonl or
+    .xlsx)."""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in sink_types:
+        raise ValueError(f"No result sink for {extension} files")
+    return sink_types[extension](filename, fields)
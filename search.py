@@ -1,7 +1,13 @@
+import array
 import heapq
-from collections.abc import Callable
-from typing import Any, Union
+import itertools
+import os
+import tempfile
+import time
+from collections.abc import Callable, Iterable, Iterator
+from typing import Any, Optional, Union
 
+from pattern_databases import UNREACHED, MultisetRanker, PatternDatabase
 from problems import Problem
 
 Number = Union[int, float]
@@ -13,22 +19,228 @@ def null_heuristic(state) -> int:
     return 0
 
 
-def weighted_heuristic(heuristic: Callable[Any, Number],
-                       weight: Number) -> Callable[Any, Number]:
+class WeightedHeuristic:
+    def __init__(self, heuristic: Callable[[Any], Number], weight: Number):
+        """Initiates a heuristic that multiplies another by a given weight.
+
+        Args:
+            heuristic: The heuristic to weight.
+            weight: The weight placed on the heuristic.
+        """
+        self.heuristic = heuristic
+        self.weight = weight
+
+    def __call__(self, state) -> Number:
+        return self.heuristic(state) * self.weight
+
+
+def weighted_heuristic(heuristic: Callable[[Any], Number],
+                       weight: Number) -> Callable[[Any], Number]:
     """Given a heuristic, weights it with a specified weight."""
-    return lambda x: heuristic(x) * weight
+    return WeightedHeuristic(heuristic, weight)
+
+
+def child_heuristic(
+        h: Callable[[Any], Number]) -> Callable[[Any, Number, Any], Number]:
+    """Given a heuristic, returns a function taking a state, its heuristic
+    value and a child state, and returning the child's heuristic value.
+    Heuristics with an update method (such as TileProblem's Manhattan
+    distance) compute this incrementally; others evaluate the child."""
+    update = getattr(h, "update", None)
+    if update is not None:
+        return update
+    return lambda parent, parent_value, child: h(child)
+
+
+class OpenList:
+    """An indexed binary min-heap, used as the open list for searches.
+
+    Each item is held at most once, alongside its priority. Pushing an item
+    that is already present changes its priority in place, so re-opening a
+    node or finding a cheaper path to it takes logarithmic time. Ties are
+    broken by comparing items, as with heapq, or by comparing their keys if
+    a key function is given (see Problem.sort_key).
+    """
+
+    def __init__(self, key: Optional[Callable[[Any], Any]] = None):
+        self.heap = []  # (priority, key, item) triples
+        self.positions = {}  # Index of each item in the heap
+        self.key = key
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def __contains__(self, item) -> bool:
+        return item in self.positions
+
+    def __iter__(self):
+        """Iterates over (priority, item) pairs, in no particular order."""
+        return ((priority, item) for priority, _, item in self.heap)
+
+    def priority(self, item) -> Number:
+        """Returns the priority of an item in the open list."""
+        return self.heap[self.positions[item]][0]
+
+    def peek(self) -> tuple[Number, Any]:
+        """Returns the (priority, item) pair with the lowest priority."""
+        priority, _, item = self.heap[0]
+        return priority, item
+
+    def push(self, item, priority: Number):
+        """Adds an item to the open list, or changes its priority if it is
+        already present."""
+        index = self.positions.get(item)
+        if index is None:
+            key = item if self.key is None else self.key(item)
+            self.heap.append((priority, key, item))
+            self._sift_up(len(self.heap) - 1)
+            return
+        old_priority, key, _ = self.heap[index]
+        self.heap[index] = (priority, key, item)
+        if priority < old_priority:
+            self._sift_up(index)
+        else:
+            self._sift_down(index)
+
+    def pop(self) -> tuple[Number, Any]:
+        """Removes and returns the (priority, item) pair with the lowest
+        priority."""
+        priority, _, item = self.heap[0]
+        self._delete(0)
+        return priority, item
+
+    def remove(self, item):
+        """Removes a given item from the open list."""
+        self._delete(self.positions[item])
 
+    def _delete(self, index: int):
+        heap = self.heap
+        del self.positions[heap[index][2]]
+        last = heap.pop()
+        if index < len(heap):
+            heap[index] = last
+            self.positions[last[2]] = index
+            self._sift_up(index)
+            self._sift_down(self.positions[last[2]])
 
-def remove_if_in_heap(heap: list, to_remove):
-    """If an item is in the heap, removes it."""
-    if to_remove in heap:
-        remove_from_heap(heap, to_remove)
+    def _sift_up(self, index: int):
+        heap = self.heap
+        positions = self.positions
+        entry = heap[index]
+        while index > 0:
+            parent = (index - 1) >> 1
+            parent_entry = heap[parent]
+            if not entry < parent_entry:
+                break
+            heap[index] = parent_entry
+            positions[parent_entry[2]] = index
+            index = parent
+        heap[index] = entry
+        positions[entry[2]] = index
 
+    def _sift_down(self, index: int):
+        heap = self.heap
+        positions = self.positions
+        size = len(heap)
+        entry = heap[index]
+        child = 2 * index + 1
+        while child < size:
+            right = child + 1
+            if right < size and heap[right] < heap[child]:
+                child = right
+            child_entry = heap[child]
+            if not child_entry < entry:
+                break
+            heap[index] = child_entry
+            positions[child_entry[2]] = index
+            index = child
+            child = 2 * index + 1
+        heap[index] = entry
+        positions[entry[2]] = index
 
-def remove_from_heap(heap: list, to_remove):
-    """Removes a given item from the given heap."""
-    heap.remove(to_remove)
-    heapq.heapify(heap)
+
+class SearchStats:
+    def __init__(self,
+                 on_expand: Optional[Callable[[Any], Any]] = None,
+                 on_goal: Optional[Callable[[Any, Number], Any]] = None):
+        """Initiates a record of the work done by a search, which can be
+        passed to a_star, weighted_a_star, weighted_a_star_with_bounds and
+        make_pdb. Searches given one count their expansions, generated
+        states, duplicates (generated states seen before) and re-openings
+        (cheaper paths to expanded states), track the largest sizes reached
+        by their open and closed lists, and time the problem's successors, the
+        heuristic and the open list operations. The same object can be
+        passed to several searches to add up their work.
+
+        Args:
+            on_expand: Optionally, a function called with each state (in the
+                form given by problem.encode) as it is expanded.
+            on_goal: Optionally, a function called with the goal state and
+                its cost when a search finds it.
+        """
+        self.on_expand = on_expand
+        self.on_goal = on_goal
+        self.expansions = 0
+        self.generations = 0
+        self.duplicates = 0
+        self.reopenings = 0
+        self.peak_open = 0
+        self.peak_closed = 0
+        self.expand_time = 0.0
+        self.heuristic_time = 0.0
+        self.heap_time = 0.0
+
+    def summary(self) -> dict[str, Number]:
+        """Returns all counts and timings as a dict."""
+        return {
+            name: value
+            for name, value in vars(self).items()
+            if not name.startswith("on_")
+        }
+
+    def timed(self, name: str, function: Callable) -> Callable:
+        """Wraps a function so that the time spent in it is added to the
+        named timing."""
+
+        def timed_function(*args):
+            begin = time.perf_counter()
+            result = function(*args)
+            elapsed = time.perf_counter() - begin
+            setattr(self, name, getattr(self, name) + elapsed)
+            return result
+
+        return timed_function
+
+    def expander(self, problem: Problem) -> Callable[..., list]:
+        """Wraps a problem's successors function so that it records
+        expansions and generated states, and calls on_expand. The wrapped
+        function takes a state (and optionally its parent) and returns a
+        list, so that generating the successors can be timed."""
+        successors = self.timed(
+            "expand_time",
+            lambda state, parent=None: list(problem.successors(state, parent)))
+
+        def counted_successors(state, parent=None) -> list:
+            self.expansions += 1
+            if self.on_expand is not None:
+                self.on_expand(state)
+            neighbours = successors(state, parent)
+            self.generations += len(neighbours)
+            return neighbours
+
+        return counted_successors
+
+    def record_sizes(self, open_size: int, closed_size: int):
+        """Updates the largest sizes reached by the open and closed lists."""
+        if open_size > self.peak_open:
+            self.peak_open = open_size
+        if closed_size > self.peak_closed:
+            self.peak_closed = closed_size
+
+    def found_goal(self, state, cost: Number):
+        """Records that a search has found a goal state."""
+        if self.on_goal is not None:
+            self.on_goal(state, cost)
 
 
 def reconstruct_path(state, parents: dict) -> list:
@@ -49,56 +261,295 @@ def reconstruct_path(state, parents: dict) -> list:
     return path
 
 
+def decode_path(path: list, problem: Problem) -> list:
+    """Converts a path of encoded states back into the problem's usual form."""
+    return [problem.decode(state) for state in path]
+
+
 def a_star(
-        start,
-        problem: Problem,
-        h: Callable[Any, Number] = null_heuristic) -> tuple[float, list[Any]]:
+    start,
+    problem: Problem,
+    h: Callable[[Any], Number] = null_heuristic,
+    stats: Optional[SearchStats] = None,
+    weight: Number = 1
+) -> tuple[float, list[Any]]:
     """A simple implementation of A*. Finds the shortest path to a goal node.
 
     Args:
         start: The beginning state.
         problem: The problem space.
-        h: A heuristic function taking a state and returning a number.
+        h: A heuristic function taking a state (in the form given by
+            problem.encode) and returning a number.
             Must be admissible for optimal solution.
+        stats: Optionally, a SearchStats in which to record the search's work.
+        weight: The weight placed on the heuristic function (see
+            weighted_a_star). Heuristic values are kept unweighted, so that
+            they can be updated incrementally, and weighted when pushed.
 
     Returns:
         A tuple of the form (cost, path).
     """
-    start = problem.canonical(start)
+    start = problem.encode(start)
+    h_child = child_heuristic(h)
 
-    opened = [(0, start)]
+    opened = OpenList(problem.sort_key)
+    successors = problem.successors
+    push = opened.push
+    pop = opened.pop
+    if stats is not None:
+        successors = stats.expander(problem)
+        h = stats.timed("heuristic_time", h)
+        h_child = stats.timed("heuristic_time", h_child)
+        push = stats.timed("heap_time", push)
+        pop = stats.timed("heap_time", pop)
+
+    push(start, 0)
     parents = {}
     g_values = {start: 0}
-    f_values = {start: h(start)}
+    h_values = {start: h(start)}
 
     while opened:
-        f_value, state = heapq.heappop(opened)
+        f_value, state = pop()
         cost = g_values[state]
 
         if problem.is_goal_state(state):
-            return cost, reconstruct_path(state, parents)
+            if stats is not None:
+                stats.found_goal(state, cost)
+            return cost, decode_path(reconstruct_path(state, parents), problem)
 
-        neighbours = problem.expand(state)
+        neighbours = successors(state, parents.get(state))
         for distance, neighbour in neighbours:
             g = cost + distance
-            h_cost = h(neighbour)
-            f = g + h_cost
             old_g = g_values.get(neighbour, infinity)
+            if stats is not None and old_g != infinity:
+                stats.duplicates += 1
+                if g < old_g and neighbour not in opened:
+                    stats.reopenings += 1
             if g < old_g:
-                if old_g != infinity:
-                    remove_if_in_heap(opened, (old_g + h_cost, neighbour))
+                h_cost = h_values.get(neighbour)
+                if h_cost is None:
+                    h_cost = h_child(state, h_values[state], neighbour)
+                    h_values[neighbour] = h_cost
                 g_values[neighbour] = g
-                f_values[neighbour] = f
-                heapq.heappush(opened, (f, neighbour))
+                push(neighbour, g + weight * h_cost)
                 parents[neighbour] = state
 
+        if stats is not None:
+            stats.record_sizes(len(opened), len(g_values) - len(opened))
+
     return infinity, [None]
 
 
+def ida_star(start,
+             problem: Problem,
+             h: Callable[[Any], Number] = null_heuristic,
+             table_size: int = 0) -> tuple[float, list[Any]]:
+    """Iterative-deepening A*. Finds the shortest path to a goal node using
+    memory proportional only to the length of the path.
+    Repeats depth-first searches bounded by a threshold on f, raising the
+    threshold to the smallest f that exceeded it each time. Moves straight
+    back to the previous state are never made.
+
+    Args:
+        start: The beginning state.
+        problem: The problem space.
+        h: A heuristic function taking a state (in the form given by
+            problem.encode) and returning a number.
+            Must be admissible for optimal solution.
+        table_size: The most states to keep in a transposition table. When a
+            search below a state fails, the table records the smallest f
+            found beyond the threshold, which gives a better heuristic value
+            for that state in later iterations. If 0, no table is kept.
+
+    Returns:
+        A tuple of the form (cost, path).
+    """
+    start = problem.encode(start)
+    h_child = child_heuristic(h)
+
+    path = [start]
+    h_path = [h(start)]  # Heuristic value of each state in the path
+    table = {}  # Heuristic values learned for states
+
+    def search(g: Number, threshold: Number) -> tuple[bool, Number]:
+        """Searches below the last state in the path. Returns (True, cost) if
+        a goal is found, leaving the path to it in path, and otherwise
+        (False, the smallest f found beyond the threshold)."""
+        state = path[-1]
+        h_value = h_path[-1]
+        learned = table.get(state)
+        if learned is not None and learned > h_value:
+            h_value = learned
+
+        f = g + h_value
+        if f > threshold:
+            return False, f
+        if problem.is_goal_state(state):
+            return True, g
+
+        parent = path[-2] if len(path) > 1 else None
+        minimum = infinity
+        bound = infinity  # Lower bound on f for any path through state
+        for distance, neighbour in problem.expand(state):
+            if neighbour == parent:
+                # Not searched, but the path back through it still bounds f
+                bound = g + distance + h_path[-2]
+                continue
+            path.append(neighbour)
+            h_path.append(h_child(state, h_path[-1], neighbour))
+            found, value = search(g + distance, threshold)
+            if found:
+                return found, value
+            path.pop()
+            h_path.pop()
+            minimum = min(minimum, value)
+
+        bound = min(bound, minimum)
+        if table_size and bound - g > h_value:
+            if len(table) >= table_size and state not in table:
+                del table[next(iter(table))]  # Forget the oldest entry
+            table[state] = bound - g
+
+        return False, minimum
+
+    threshold = h_path[0]
+    while True:
+        found, value = search(0, threshold)
+        if found:
+            return value, decode_path(path, problem)
+        if value == infinity:
+            return infinity, [None]
+        threshold = value
+
+
+def bidirectional_search(
+    start,
+    problem: Problem,
+    h: Callable[[Any], Number] = null_heuristic,
+    h_backward: Callable[[Any], Number] = null_heuristic,
+    stats: Optional[SearchStats] = None
+) -> tuple[float, list[Any]]:
+    """Front-to-end bidirectional A* (BAE*). Searches forwards from the start
+    and backwards from the problem's single goal state at once, sharing the
+    cheapest path found where the two searches meet.
+    Each direction orders states by 2g + h - h', where h estimates the
+    distance to its far end and h' the distance from its own. The search
+    stops once no path through an open state could be cheaper than the best
+    found, i.e. when the best cost is at most half the sum of the two lowest
+    priorities. Moves must be reversible at the same cost, as in tile
+    problems, since problem.successors is used in both directions.
+
+    Args:
+        start: The beginning state.
+        problem: The problem space, with a goal_state.
+        h: A heuristic function estimating the distance from a state (in
+            the form given by problem.encode) to the goal.
+        h_backward: A heuristic function estimating the distance to a state
+            from the start. For tile problems, this can be a
+            ManhattanDistance with the encoded start state as its target.
+            Both heuristics must be consistent for optimal solution.
+        stats: Optionally, a SearchStats in which to record the search's work.
+
+    Returns:
+        A tuple of the form (cost, path).
+    """
+    start = problem.encode(start)
+    goal = problem.goal_state()
+    if goal is None:
+        raise ValueError("Bidirectional search needs a single goal state")
+
+    successors = problem.successors
+    if stats is not None:
+        successors = stats.expander(problem)
+
+    forward = BidirectionalFrontier(start, h, h_backward)
+    backward = BidirectionalFrontier(goal, h_backward, h)
+    best_cost = infinity
+    meeting_state = None
+    if start == goal:
+        best_cost, meeting_state = 0, start
+
+    while forward.opened and backward.opened:
+        lowest_forward = forward.opened.peek()[0]
+        lowest_backward = backward.opened.peek()[0]
+        if best_cost <= (lowest_forward + lowest_backward) / 2:
+            break
+
+        if lowest_forward <= lowest_backward:
+            this, other = forward, backward
+        else:
+            this, other = backward, forward
+        _, state = this.opened.pop()
+        cost = this.g_values[state]
+        for distance, neighbour in successors(state, this.parents.get(state)):
+            g = cost + distance
+            if not this.improve(state, neighbour, g, best_cost):
+                continue
+            other_g = other.g_values.get(neighbour)
+            if other_g is not None and g + other_g < best_cost:
+                best_cost = g + other_g
+                meeting_state = neighbour
+
+        if stats is not None:
+            open_size = len(forward.opened) + len(backward.opened)
+            reached = len(forward.g_values) + len(backward.g_values)
+            stats.record_sizes(open_size, reached - open_size)
+
+    if meeting_state is None:
+        return infinity, [None]
+    if stats is not None:
+        stats.found_goal(goal, best_cost)
+    path = reconstruct_path(meeting_state, forward.parents)
+    path += reconstruct_path(meeting_state, backward.parents)[-2::-1]
+    return best_cost, decode_path(path, problem)
+
+
+class BidirectionalFrontier:
+    def __init__(self, origin, h: Callable[[Any], Number],
+                 h_origin: Callable[[Any], Number]):
+        """Initiates one direction of a bidirectional search.
+
+        Args:
+            origin: The encoded state this direction searches from.
+            h: A heuristic estimating the distance to the other end.
+            h_origin: A heuristic estimating the distance from the origin.
+        """
+        self.h_child = child_heuristic(h)
+        self.h_origin_child = child_heuristic(h_origin)
+        self.opened = OpenList()  # Keyed by 2g + h - h_origin
+        self.parents = {}
+        self.g_values = {origin: 0}
+        self.h_values = {origin: (h(origin), h_origin(origin))}
+        self.opened.push(origin, self.priority(origin))
+
+    def priority(self, state) -> Number:
+        h_value, h_origin_value = self.h_values[state]
+        return 2 * self.g_values[state] + h_value - h_origin_value
+
+    def improve(self, parent, state, g: Number, best_cost: Number) -> bool:
+        """Opens (or re-opens) a state reached from a parent with a given g,
+        unless it has already been reached as cheaply or could not lead to a
+        path cheaper than best_cost. Returns True if the state was opened."""
+        if self.g_values.get(state, infinity) <= g:
+            return False
+        if state not in self.h_values:
+            h_value, h_origin_value = self.h_values[parent]
+            self.h_values[state] = (
+                self.h_child(parent, h_value, state),
+                self.h_origin_child(parent, h_origin_value, state))
+        if g + self.h_values[state][0] >= best_cost:
+            return False
+        self.parents[state] = parent
+        self.g_values[state] = g
+        self.opened.push(state, self.priority(state))
+        return True
+
+
 def weighted_a_star(start,
                     problem: Problem,
-                    h: Callable[Any, Number] = null_heuristic,
-                    weight: Number = 1) -> tuple[float, Any]:
+                    h: Callable[[Any], Number] = null_heuristic,
+                    weight: Number = 1,
+                    stats: Optional[SearchStats] = None) -> tuple[float, Any]:
     """A simple implementation of weighted A*. Faster but suboptimal.
 
     Args:
@@ -109,121 +560,500 @@ def weighted_a_star(start,
         weight: The weight placed on the heuristic function. The solution
             cost is guaranteed to be no more than the true cost multiplied
             by this weight.
+        stats: Optionally, a SearchStats in which to record the search's work.
 
     Returns:
         A tuple of the form (cost, path).
     """
 
-    h = weighted_heuristic(h, weight)
-    return a_star(start, problem, h)
+    return a_star(start, problem, h, stats, weight)
 
 
-def make_pdb(start, problem: Problem) -> dict[Any, Number]:
-    """Uses a simple Dijkstra search to compute the distance from a state to
-    all other reachable states. Has no need for a heuristic, and so does not
-    use one.
+def make_pdb(start,
+             problem: Problem,
+             stats: Optional[SearchStats] = None) -> PatternDatabase:
+    """Uses a breadth-first search to compute the distance from a state to
+    all other reachable states. Every move must cost 1, as in tile problems,
+    so no heap or heuristic is needed. Distances are kept in an array indexed
+    by the rank of each state rather than in a dict of states.
 
     Args:
         start: The initial state. All distances will be from this state.
-        problem: The problem space.
+        problem: The problem space. Its encoded states must be bytes.
+        stats: Optionally, a SearchStats in which to record the search's work.
+            Each layer of the search counts as the open list.
 
     Returns:
-        A dictionary of the form {state: distance}.
+        A PatternDatabase mapping encoded states to their distances.
     """
-    start = problem.canonical(start)
+    start = problem.encode(start)
 
-    opened = [(0, start)]
-    g_values = {start: 0}
+    pdb = PatternDatabase(start)
+    distances = pdb.distances
+    rank = pdb.ranker.rank
+    distances[rank(start)] = 0
 
-    while opened:
-        cost, state = heapq.heappop(opened)
-        neighbours = problem.expand(state)
-        for distance, neighbour in neighbours:
-            g = cost + distance
-            old_g = g_values.get(neighbour, infinity)
-            if g < old_g:
-                if old_g != infinity:
-                    remove_if_in_heap(opened, (old_g, neighbour))
-                g_values[neighbour] = g
-                heapq.heappush(opened, (g, neighbour))
+    expand = problem.expand
+    if stats is not None:
+        expand = stats.expander(problem)
+    reached = 1
+
+    layer = [start]
+    depth = 0
+    while layer:
+        depth += 1
+        if depth >= UNREACHED:
+            raise ValueError(f"Distances of {depth} or more cannot be stored")
+        next_layer = []
+        for state in layer:
+            for distance, neighbour in expand(state):
+                if distance != 1:
+                    raise ValueError("make_pdb requires moves to cost 1")
+                index = rank(neighbour)
+                if distances[index] == UNREACHED:
+                    distances[index] = depth
+                    next_layer.append(neighbour)
+                elif stats is not None:
+                    stats.duplicates += 1
+        if stats is not None:
+            stats.record_sizes(len(layer) + len(next_layer),
+                               reached - len(layer))
+        reached += len(next_layer)
+        layer = next_layer
+
+    return pdb
+
+
+def write_ranks(filename: str,
+                ranks: Iterable[int],
+                chunk_size: int = 1 << 16) -> int:
+    """Writes ranks to a file as unsigned 64-bit integers, buffering them in
+    chunks of up to chunk_size ranks. Returns the number of ranks written."""
+    count = 0
+    with open(filename, "wb") as file:
+        chunk = array.array("Q")
+        for rank in ranks:
+            chunk.append(rank)
+            if len(chunk) >= chunk_size:
+                chunk.tofile(file)
+                count += len(chunk)
+                chunk = array.array("Q")
+        chunk.tofile(file)
+        count += len(chunk)
+    return count
+
+
+def read_ranks(filename: str, chunk_size: int = 1 << 16) -> Iterator[int]:
+    """Yields the ranks in a file written by write_ranks, reading them in
+    chunks of up to chunk_size ranks."""
+    with open(filename, "rb") as file:
+        while True:
+            chunk = array.array("Q")
+            chunk.frombytes(file.read(chunk.itemsize * chunk_size))
+            if not chunk:
+                return
+            yield from chunk
+
+
+def unique_ranks(ranks: Iterable[int], excluded: list[Iterator[int]]):
+    """Given sorted ranks, yields each once, leaving out any found in the
+    sorted excluded streams (which are advanced alongside it)."""
+    heads = [next(stream, None) for stream in excluded]
+    previous = None
+    for rank in ranks:
+        if rank == previous:
+            continue
+        previous = rank
+        for index, stream in enumerate(excluded):
+            while heads[index] is not None and heads[index] < rank:
+                heads[index] = next(stream, None)
+        if rank not in heads:
+            yield rank
+
+
+def make_pdb_external(start,
+                      problem: Problem,
+                      filename: str,
+                      memory_budget: int = 1 << 20,
+                      directory: Optional[str] = None,
+                      stats: Optional[SearchStats] = None,
+                      max_files: int = 64) -> PatternDatabase:
+    """Like make_pdb, but for abstractions too big for memory. Each layer of
+    the breadth-first search is kept on disk as a sorted file of ranks, and
+    distances are written straight to a memory-mapped PDB file.
+
+    The neighbours of a layer are ranked and collected until the budget is
+    full, then sorted and written out as a run. The runs are then merged,
+    dropping duplicates and any states in the two layers before, to make the
+    next layer. This relies on every move being reversible (as in tile
+    problems), so that none of a layer's neighbours can be more than one
+    layer back. Only a limited number of runs are merged at once (as many
+    as the budget and max_files allow), so if there are more, they are first
+    merged in groups into longer runs, as many times as needed.
+
+    Args:
+        start: The initial state. All distances will be from this state.
+        problem: The problem space. Its encoded states must be bytes.
+        filename: The PDB file to write (see PatternDatabase.save).
+        memory_budget: The most ranks to hold in memory at once.
+        directory: Where to keep layer and run files. Defaults to the
+            system's temporary directory.
+        stats: Optionally, a SearchStats in which to record the search's work.
+            Ranks held in memory count as the open list.
+        max_files: The most run files to merge at once.
+
+    Returns:
+        The PatternDatabase, memory-mapped from the file.
+    """
+    start = problem.encode(start)
+    ranker = MultisetRanker(start)
+    rank = ranker.rank
+    unrank = ranker.unrank
+
+    expand = problem.expand
+    if stats is not None:
+        expand = stats.expander(problem)
+
+    # The final merge reads fan_in runs and the two layers before, and
+    # writes the new layer, each through a buffer of chunk_size ranks.
+    # Chunks are kept to a reasonable size where the budget allows.
+    fan_in = max(2, min(max_files, memory_budget // 1024 - 3))
+    chunk_size = max(1, memory_budget // (fan_in + 3))
+    # Neighbours are collected while the layer is read and runs are written
+    run_size = max(1, memory_budget - 2 * chunk_size)
+
+    pdb = PatternDatabase.create(filename, start)
+    distances = pdb.distances
+    distances[rank(start)] = 0
+
+    with tempfile.TemporaryDirectory(dir=directory) as workspace:
+        run_names = itertools.count()
+
+        def layer_file(depth: int) -> str:
+            return os.path.join(workspace, f"layer{depth}.ranks")
+
+        def run_file() -> str:
+            return os.path.join(workspace, f"run{next(run_names)}.ranks")
+
+        def write_run(ranks: list[int]) -> str:
+            if stats is not None:
+                stats.record_sizes(len(ranks), 0)
+            run = run_file()
+            ranks.sort()
+            write_ranks(run, ranks, chunk_size)
+            return run
+
+        def merge_runs(runs: list[str]) -> Iterator[int]:
+            return heapq.merge(*(read_ranks(run, chunk_size) for run in runs))
+
+        def merge_pass(runs: list[str]) -> list[str]:
+            """Merges runs in groups of fan_in, returning the longer runs."""
+            merged = []
+            for begin in range(0, len(runs), fan_in):
+                group = runs[begin:begin + fan_in]
+                run = run_file()
+                write_ranks(run, merge_runs(group), chunk_size)
+                for old_run in group:
+                    os.remove(old_run)
+                merged.append(run)
+            return merged
 
-    return g_values
+        def record(ranks: Iterator[int]) -> Iterator[int]:
+            for new_rank in ranks:
+                distances[new_rank] = depth
+                yield new_rank
 
+        layer_size = write_ranks(layer_file(0), [rank(start)])
+        depth = 0
+        while layer_size:
+            depth += 1
+            if depth >= UNREACHED:
+                raise ValueError(
+                    f"Distances of {depth} or more cannot be stored")
 
-def weighted_a_star_with_bounds(start,
-                                problem: Problem,
-                                h: Callable[Any, Number] = null_heuristic,
-                                w: Number = 1) -> tuple[float, Any]:
+            runs = []
+            buffer = []
+            generated = 0
+            for state_rank in read_ranks(layer_file(depth - 1), chunk_size):
+                for distance, neighbour in expand(unrank(state_rank)):
+                    if distance != 1:
+                        raise ValueError("make_pdb requires moves to cost 1")
+                    buffer.append(rank(neighbour))
+                    if len(buffer) >= run_size:
+                        generated += len(buffer)
+                        runs.append(write_run(buffer))
+                        buffer = []
+            if buffer:
+                generated += len(buffer)
+                runs.append(write_run(buffer))
+                buffer = []
+
+            while len(runs) > fan_in:
+                runs = merge_pass(runs)
+            merged = merge_runs(runs)
+            earlier = [
+                read_ranks(layer_file(before), chunk_size)
+                for before in (depth - 1, depth - 2) if before >= 0
+            ]
+            new_ranks = unique_ranks(merged, earlier)
+            layer_size = write_ranks(layer_file(depth), record(new_ranks),
+                                     chunk_size)
+            for stream in earlier:  # Closes their files
+                stream.close()
+            if stats is not None:
+                stats.duplicates += generated - layer_size
+
+            for run in runs:
+                os.remove(run)
+            if depth >= 2:
+                os.remove(layer_file(depth - 2))
+
+    pdb.distances.obj.flush()
+    return pdb
+
+
+def weighted_a_star_with_bounds(
+        start,
+        problem: Problem,
+        h: Callable[[Any], Number] = null_heuristic,
+        w: Number = 1,
+        stats: Optional[SearchStats] = None) -> tuple[float, Any]:
     """Weighted A* that also returns values needed to calculate F and X bounds.
 
     Args:
         start: The beginning state.
         problem: The problem space.
-        h: A heuristic function taking a state and returning a number.
+        h: A heuristic function taking a state (in the form given by
+            problem.encode) and returning a number.
         w: The weight placed on the heuristic function. The solution
             cost is guaranteed to be no more than the true cost multiplied
             by this weight.
+        stats: Optionally, a SearchStats in which to record the search's work.
 
     Returns:
         A tuple of the form (cost, path, F, f_iter, g_min, g_iter, f_bound, x_bound).
     """
 
-    Wh = weighted_heuristic(h, w)
+    h_child = child_heuristic(h)
 
-    start = problem.canonical(start)
+    start = problem.encode(start)
 
-    opened = [(Wh(start), start)]
+    opened = OpenList(problem.sort_key)
+    g_heap = OpenList()  # Open nodes keyed by g
+    f_heap = OpenList()  # Open nodes keyed by unweighted f (g + h)
+    successors = problem.successors
+    push = opened.push
+    pop = opened.pop
+    push_g = g_heap.push
+    remove_g = g_heap.remove
+    push_f = f_heap.push
+    remove_f = f_heap.remove
+    if stats is not None:
+        successors = stats.expander(problem)
+        h = stats.timed("heuristic_time", h)
+        h_child = stats.timed("heuristic_time", h_child)
+        push = stats.timed("heap_time", push)
+        pop = stats.timed("heap_time", pop)
+        push_g = stats.timed("heap_time", push_g)
+        remove_g = stats.timed("heap_time", remove_g)
+        push_f = stats.timed("heap_time", push_f)
+        remove_f = stats.timed("heap_time", remove_f)
+
+    h_values = {start: h(start)}  # Unweighted
+    push(start, w * h_values[start])
     parents = {}
     g_values = {start: 0}
-    f_values = {start: Wh(start)}
     F = float("-inf")
     g_min = infinity
-    g_heap = [(0, start)]
+    push_g(start, 0)
+    push_f(start, h_values[start])
     f_iter = -1
     g_iter = -1
 
     iteration = 0
     while opened:
         iteration += 1
-        f_w_min, current = heapq.heappop(opened)
+        f_w_min, current = pop()
         cost = g_values[current]
 
         if f_w_min > F:
             F = f_w_min
             f_iter = iteration
-            g_min = g_heap[0][0]
+            g_min = g_heap.peek()[0]
             g_iter = iteration
         elif f_w_min == F:
-            lowest_g = g_heap[0][0]
+            lowest_g = g_heap.peek()[0]
             if lowest_g < g_min:
                 g_min = lowest_g
                 g_iter = iteration
 
         if problem.is_goal_state(current):
-            unweighted_f_values = [g + h(state) for g, state in g_heap]
-            min_f = min(unweighted_f_values)  # Not largest!
+            if stats is not None:
+                stats.found_goal(current, cost)
+            min_f = f_heap.peek()[0]  # Not largest!
             f_bound = (cost * w) / (F + (w - 1) * g_min)
             x_bound = cost / min_f
-            path = reconstruct_path(current, parents)
+            path = decode_path(reconstruct_path(current, parents), problem)
 
             return cost, path, F, f_iter, g_min, g_iter, f_bound, x_bound
 
-        remove_from_heap(g_heap, (cost, current))
+        remove_g(current)
+        remove_f(current)
 
-        neighbours = problem.expand(current)
+        neighbours = successors(current, parents.get(current))
         for distance, neighbour in neighbours:
             g = cost + distance
-            Wh_cost = Wh(neighbour)
-            f = g + Wh_cost
             old_g = g_values.get(neighbour, infinity)
+            if stats is not None and old_g != infinity:
+                stats.duplicates += 1
+                if g < old_g and neighbour not in opened:
+                    stats.reopenings += 1
             if g < old_g:
-                if old_g != infinity:
-                    remove_if_in_heap(opened, (old_g + Wh_cost, neighbour))
-                    remove_if_in_heap(g_heap, (old_g, neighbour))
+                h_cost = h_values.get(neighbour)
+                if h_cost is None:
+                    h_cost = h_child(current, h_values[current], neighbour)
+                    h_values[neighbour] = h_cost
                 g_values[neighbour] = g
-                f_values[neighbour] = f
-                heapq.heappush(opened, (f, neighbour))
-                heapq.heappush(g_heap, (g, neighbour))
+                push(neighbour, g + w * h_cost)
+                push_g(neighbour, g)
+                push_f(neighbour, g + h_cost)
                 parents[neighbour] = current
 
+        if stats is not None:
+            stats.record_sizes(len(opened), len(g_values) - len(opened))
+
     return infinity, [None], F, f_iter, g_min, g_iter, infinity, infinity
+
+
+def anytime_weighted_a_star(
+        start,
+        problem: Problem,
+        h: Callable[[Any], Number] = null_heuristic,
+        weights: Iterable[Number] = (24, 16, 8, 4),
+        stats: Optional[SearchStats] = None) -> dict[Number, tuple]:
+    """Anytime weighted A* (in the style of ARA*), which searches with each of
+    a schedule of weights in turn, from largest to smallest. Instead of
+    starting over, each search carries on from the last: the open list is
+    kept (reprioritised for the new weight), along with every g value found.
+    Nodes whose g improves after they have been expanded in a search are not
+    re-expanded in it, but are kept as inconsistent and opened in the next.
+
+    Args:
+        start: The beginning state.
+        problem: The problem space.
+        h: A heuristic function taking a state (in the form given by
+            problem.encode) and returning a number.
+        weights: The weights to search with. Each solution costs no more than
+            the true cost multiplied by its weight.
+        stats: Optionally, a SearchStats in which to record the work of all
+            the searches together.
+
+    Returns:
+        A dict mapping each weight to a tuple of the form returned by
+        weighted_a_star_with_bounds: (cost, path, F, f_iter, g_min, g_iter,
+        f_bound, x_bound). Iterations are counted from the start of each
+        weight's search, and g_min and x_bound take inconsistent nodes into
+        account as well as open ones. As in ARA*, the cost is the goal's g
+        value, so the path can cost less if nodes on it were improved after
+        the goal was reached through them.
+    """
+    h_child = child_heuristic(h)
+
+    start = problem.encode(start)
+
+    successors = problem.successors
+    if stats is not None:
+        successors = stats.expander(problem)
+        h = stats.timed("heuristic_time", h)
+        h_child = stats.timed("heuristic_time", h_child)
+
+    parents = {}
+    g_values = {start: 0}
+    h_values = {start: h(start)}
+    g_heap = OpenList()  # Open and inconsistent nodes keyed by g
+    f_heap = OpenList()  # Open and inconsistent nodes keyed by g + h
+    g_heap.push(start, 0)
+    f_heap.push(start, h_values[start])
+    opened = OpenList(problem.sort_key)
+    inconsistent = {start}
+    results = {}
+
+    for w in sorted(set(weights), reverse=True):
+        frontier = [state for _, state in opened]
+        frontier.extend(inconsistent)
+        inconsistent = set()
+        opened = OpenList(problem.sort_key)
+        for state in frontier:
+            opened.push(state, g_values[state] + w * h_values[state])
+        closed = set()
+
+        F = float("-inf")
+        g_min = infinity
+        f_iter = -1
+        g_iter = -1
+        result = (infinity, [None], F, f_iter, g_min, g_iter, infinity,
+                  infinity)
+
+        iteration = 0
+        while opened:
+            iteration += 1
+            f_w_min, current = opened.peek()
+            cost = g_values[current]
+
+            if f_w_min > F:
+                F = f_w_min
+                f_iter = iteration
+                g_min = g_heap.peek()[0]
+                g_iter = iteration
+            elif f_w_min == F:
+                lowest_g = g_heap.peek()[0]
+                if lowest_g < g_min:
+                    g_min = lowest_g
+                    g_iter = iteration
+
+            if problem.is_goal_state(current):
+                # The goal stays open, to be improved on by later searches
+                if stats is not None:
+                    stats.found_goal(current, cost)
+                if cost:
+                    min_f = f_heap.peek()[0]
+                    f_bound = (cost * w) / (F + (w - 1) * g_min)
+                    x_bound = cost / min_f
+                else:  # Started at the goal, so the path is optimal
+                    f_bound = x_bound = 1.0
+                path = decode_path(reconstruct_path(current, parents), problem)
+                result = (cost, path, F, f_iter, g_min, g_iter, f_bound,
+                          x_bound)
+                break
+
+            opened.pop()
+            g_heap.remove(current)
+            f_heap.remove(current)
+            closed.add(current)
+
+            for distance, neighbour in successors(current,
+                                                  parents.get(current)):
+                g = cost + distance
+                old_g = g_values.get(neighbour, infinity)
+                if stats is not None and old_g != infinity:
+                    stats.duplicates += 1
+                if g < old_g:
+                    h_cost = h_values.get(neighbour)
+                    if h_cost is None:
+                        h_cost = h_child(current, h_values[current], neighbour)
+                        h_values[neighbour] = h_cost
+                    g_values[neighbour] = g
+                    parents[neighbour] = current
+                    g_heap.push(neighbour, g)
+                    f_heap.push(neighbour, g + h_cost)
+                    if neighbour in closed:
+                        inconsistent.add(neighbour)
+                    else:
+                        opened.push(neighbour, g + w * h_cost)
+
+            if stats is not None:
+                stats.record_sizes(len(opened), len(closed))
+
+        results[w] = result
+
+    return results
@@ -0,0 +1,179 @@
+"""A persistent cache of search results, so that repeated sweeps need not
+solve the same problems again.
+
+Results are stored in an SQLite file, keyed by a hash of the search function,
+the start state, the problem's goal, the heuristic, the weight and the
+version of the code. Changing any of the modules the results depend on
+changes the version, and results from other versions are discarded when the
+cache is opened.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+from collections.abc import Callable
+from typing import Any, Optional
+
+import heuristics
+import problems
+import search
+from problems import Number
+
+# Modules whose code the cached results depend on
+source_files = ["search.py", "problems.py", "pattern_databases.py",
+                "heuristics.py"]
+
+
+def code_version() -> str:
+    """Returns a hash of the source code of the modules in source_files."""
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for filename in source_files:
+        with open(os.path.join(directory, filename), "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def heuristic_identity(h: Callable[[Any], Number]) -> Optional[str]:
+    """Returns a name for a heuristic that stays the same between runs, or
+    None if it has none (as for lambdas and nested functions)."""
+    if isinstance(h, heuristics.CachedHeuristic):
+        return heuristic_identity(h.heuristic)
+    if isinstance(h, search.WeightedHeuristic):
+        identity = heuristic_identity(h.heuristic)
+        if identity is None:
+            return None
+        return f"{identity}*{h.weight!r}"
+    identity = getattr(h, "identity", None)
+    if identity is not None:
+        return identity
+    name = getattr(h, "__qualname__", None)
+    if name is None or "<" in name:  # Lambdas and nested functions
+        return None
+    return f"{h.__module__}.{name}"
+
+
+def goal_identity(problem: problems.Problem) -> str:
+    """Returns a description of a problem's goal. For tile problems, this
+    includes adjacencies, which str(problem) leaves out."""
+    if isinstance(problem, problems.TileProblem):
+        return problem.decode(problem.goal, full=True)
+    return str(problem)
+
+
+class SolutionCache:
+    def __init__(self,
+                 filename: str = "Solutions.sqlite3",
+                 version: Optional[str] = None):
+        """Opens (or creates) a cache of search results in an SQLite file.
+        Can be used as a context manager, which closes the cache on exit.
+
+        Args:
+            filename: The file in which results are stored.
+            version: The version of the code results are valid for. Defaults
+                to a hash of its source (see code_version).
+        """
+        self.version = code_version() if version is None else version
+        self.connection = sqlite3.connect(filename, timeout=60)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS solutions "
+                "(key TEXT PRIMARY KEY, version TEXT, result TEXT)")
+            self.connection.execute(
+                "DELETE FROM solutions WHERE version != ?", (self.version,))
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, function_name: str, start, problem: problems.Problem,
+            h: Callable[[Any], Number], weight: Number) -> Optional[str]:
+        """Returns the key under which a search's result is stored, or None
+        if the heuristic cannot be identified (so the result cannot be
+        cached)."""
+        identity = heuristic_identity(h)
+        if identity is None:
+            return None
+        start = problem.encode(start)
+        if isinstance(start, bytes):
+            start = start.hex()
+        description = json.dumps([
+            function_name,
+            str(start),
+            goal_identity(problem),
+            identity,
+            weight,
+            self.version,
+        ])
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def get(self, key: Optional[str]) -> Optional[tuple]:
+        """Returns the result stored under a key, or None if there is none."""
+        if key is None:
+            return None
+        row = self.connection.execute(
+            "SELECT result FROM solutions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return tuple(json.loads(row[0]))
+
+    def put(self, key: Optional[str], result: tuple):
+        """Stores a result under a key (unless the key is None)."""
+        if key is None:
+            return
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO solutions VALUES (?, ?, ?)",
+                (key, self.version, json.dumps(result)))
+
+    def solve(self, function: Callable[..., tuple], start,
+              problem: problems.Problem, h: Callable[[Any], Number],
+              weight: Number) -> tuple:
+        """Returns the result of function(start, problem, h, weight), from the
+        cache if it is there, and otherwise by running the search (and then
+        storing its result)."""
+        key = self.key(function.__name__, start, problem, h, weight)
+        result = self.get(key)
+        if result is None:
+            result = function(start, problem, h, weight)
+            self.put(key, result)
+        return result
+
+    def a_star(self,
+               start,
+               problem: problems.Problem,
+               h: Callable[[Any], Number] = search.null_heuristic) -> tuple:
+        """Cached version of search.a_star."""
+        key = self.key("a_star", start, problem, h, 1)
+        result = self.get(key)
+        if result is None:
+            result = search.a_star(start, problem, h)
+            self.put(key, result)
+        return result
+
+    def weighted_a_star(self,
+                        start,
+                        problem: problems.Problem,
+                        h: Callable[[Any], Number],
+                        weight: Number = 1) -> tuple:
+        """Cached version of search.weighted_a_star."""
+        return self.solve(search.weighted_a_star, start, problem, h, weight)
+
+    def weighted_a_star_with_bounds(
+            self,
+            start,
+            problem: problems.Problem,
+            h: Callable[[Any], Number] = search.null_heuristic,
+            w: Number = 1) -> tuple:
+        """Cached version of search.weighted_a_star_with_bounds."""
+        return self.solve(search.weighted_a_star_with_bounds, start, problem,
+                          h, w)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self) -> "SolutionCache":
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
@@ -0,0 +1,151 @@
+"""Checks the searches and PDB generators against exact goal distances.
+
+Run with pytest from the repository's root directory.
+"""
+import os
+import sys
+
+import pytest
+
+directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(directory)
+import heuristics
+import problems
+import search
+from pattern_databases import MultisetRanker
+
+weights = [1, 2, 4, 8]
+
+
+@pytest.fixture(scope="module")
+def problem() -> problems.TileProblem:
+    with open(os.path.join(directory, "assignment2", "GoalState.txt")) as file:
+        return problems.TileProblem(file.read().strip())
+
+
+@pytest.fixture(scope="module")
+def oracle(problem) -> heuristics.GoalDistanceOracle:
+    return heuristics.GoalDistanceOracle(problem)
+
+
+@pytest.fixture(scope="module")
+def states(problem) -> list[bytes]:
+    """A few problems of each C* shipped for Assignment 2."""
+    states = []
+    for c_star in [10, 15, 20]:
+        filename = os.path.join(directory, "assignment2",
+                                f"Problems{c_star}.txt")
+        states.extend(problem.load_states(filename)[:5])
+    return states
+
+
+def pattern_goal(problem: problems.TileProblem, merged: list[int]) -> bytes:
+    """Returns the goal abstracted by merging the given tiles."""
+    table = problem.abstraction({tile: merged[0] for tile in merged})
+    return problem.abstract(problem.goal, table)
+
+
+@pytest.mark.parametrize("merged", [[1, 2, 3, 4], [2, 4, 6, 8, 1]])
+def test_rank_unrank_round_trip(problem, merged):
+    ranker = MultisetRanker(pattern_goal(problem, merged))
+    seen = set()
+    for rank in range(ranker.size):
+        state = ranker.unrank(rank)
+        assert ranker.rank(state) == rank
+        seen.add(state)
+    assert len(seen) == ranker.size
+
+
+@pytest.mark.parametrize("memory_budget, max_files", [(10, 64), (100, 2),
+                                                      (1000, 3),
+                                                      (1 << 20, 64)])
+def test_make_pdb_external_matches_make_pdb(problem, tmp_path, memory_budget,
+                                            max_files):
+    goal = pattern_goal(problem, [1, 2, 3, 4])
+    expected = search.make_pdb(goal, problem)
+    pdb = search.make_pdb_external(goal,
+                                   problem,
+                                   str(tmp_path / "external.pdb"),
+                                   memory_budget,
+                                   str(tmp_path),
+                                   max_files=max_files)
+    assert bytes(pdb.distances) == bytes(expected.distances)
+
+
+def test_open_list_order():
+    opened = search.OpenList()
+    for item, priority in [("c", 3), ("a", 5), ("b", 3), ("d", 1)]:
+        opened.push(item, priority)
+    opened.push("a", 2)  # Decreased
+    opened.push("d", 4)  # Increased
+    opened.remove("c")
+    assert [opened.pop() for _ in range(len(opened))] == [(2, "a"), (3, "b"),
+                                                          (4, "d")]
+
+
+def test_sort_key_orders_as_canonical_strings(problem, states):
+    shuffled = states[::-1]
+    assert (sorted(shuffled, key=problem.sort_key) == sorted(shuffled,
+                                                             key=problem.decode))
+
+
+def test_a_star_is_optimal(problem, oracle, states):
+    for state in states:
+        cost, path = search.a_star(state, problem, problem.manhattan_distance)
+        assert cost == oracle.cost(state)
+        assert not oracle.validate(state, (cost, path))
+
+
+@pytest.mark.parametrize("w", weights)
+def test_weighted_a_star_within_weight(problem, oracle, states, w):
+    for state in states:
+        result = search.weighted_a_star(state, problem,
+                                        problem.manhattan_distance, w)
+        assert not oracle.validate(state, result, w)
+
+
+@pytest.mark.parametrize("w", weights)
+def test_weighted_a_star_with_bounds(problem, oracle, states, w):
+    for state in states:
+        result = search.weighted_a_star_with_bounds(state, problem,
+                                                    problem.manhattan_distance,
+                                                    w)
+        # The F bound is not guaranteed, so only the X bound is checked
+        faults = oracle.validate(state, result, w)
+        assert not [fault for fault in faults if "F bound" not in fault]
+
+
+def test_anytime_weighted_a_star(problem, oracle, states):
+    for state in states:
+        results = search.anytime_weighted_a_star(state, problem,
+                                                 problem.manhattan_distance,
+                                                 weights)
+        for w, result in results.items():
+            assert oracle.cost(state) <= result[0] <= w * oracle.cost(state)
+
+
+def test_anytime_weighted_a_star_from_goal(problem):
+    results = search.anytime_weighted_a_star(problem.goal, problem,
+                                             problem.manhattan_distance)
+    for result in results.values():
+        assert result[0] == 0
+        assert result[6:] == (1.0, 1.0)
+
+
+def test_bidirectional_search_is_optimal(problem, oracle, states):
+    for state in states:
+        h_backward = problems.ManhattanDistance(problem, state)
+        result = search.bidirectional_search(state, problem,
+                                             problem.manhattan_distance,
+                                             h_backward)
+        assert result[0] == oracle.cost(state)
+        assert not oracle.validate(state, result)
+
+
+@pytest.mark.parametrize("table_size", [0, 1000])
+def test_ida_star_is_optimal(problem, oracle, states, table_size):
+    for state in states[:10]:
+        result = search.ida_star(state, problem, problem.manhattan_distance,
+                                 table_size)
+        assert result[0] == oracle.cost(state)
+        assert not oracle.validate(state, result)